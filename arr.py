@@ -0,0 +1,133 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from pyarr.exceptions import PyarrBadGateway, PyarrConnectionError, PyarrServerError
+from requests.adapters import HTTPAdapter
+
+import metrics
+from autocomplete import TitleIndex
+from cache import TTLCache
+from health import CircuitBreaker, CircuitOpenError
+from library import LibraryIndex
+from scheduler import RateLimiter
+
+
+# errors that mean the instance is down or overloaded, as opposed to a bad request
+OUTAGE_ERRORS = (requests.RequestException, PyarrConnectionError, PyarrServerError, PyarrBadGateway)
+# what callers see while an instance is unavailable
+UNAVAILABLE_ERRORS = (CircuitOpenError, *OUTAGE_ERRORS)
+
+
+def unavailable_message(instance: "ArrClient") -> str:
+    return f"{instance.name} is unavailable right now. Please try again in a few minutes."
+
+
+def missing_profile_message(instance: "ArrClient", quality_profile: str) -> str:
+    if not instance.metadata_loaded:
+        # the instance hasn't been reachable since the bot started
+        return unavailable_message(instance)
+    return f"The quality profile \"{quality_profile}\" no longer exists on {instance.name}. Please ask an admin to update this command."
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """Applies a default timeout, pyarr never passes one and requests waits forever without it.
+
+    Also raises for a 5xx response that isn't JSON, e.g. a reverse proxy's 503 while Radarr/Sonarr restarts,
+    which pyarr would otherwise fail on with an AssertionError that doesn't look like an outage.
+    """
+
+    def __init__(self, *args, timeout: float = 10, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        response = super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+        if response.status_code >= 500 and "json" not in response.headers.get("Content-Type", ""):
+            response.close()
+            raise requests.HTTPError(f"{response.status_code} {response.reason} from {request.url}", request=request, response=response)
+        return response
+
+
+class ArrClient:
+    """Wraps a pyarr api and runs its blocking calls on a bounded thread pool"""
+
+    def __init__(self, api, name: str, instance_type: str, max_workers: int = 8, lookup_cache_size: int = 256, lookup_cache_ttl: float = 600,
+                 lookup_cache_stale_ttl: float = 0, rate_limit: float = 0, timeout: float = 10, failure_threshold: int = 5, retry_interval: float = 30):
+        self.api = api
+        self.name = name # e.g. "Radarr" or "Radarr 4K"
+        self.instance_type = instance_type # Radarr or Sonarr
+        # budget of requests per second shared by every caller, 0 disables it
+        self.rate_limiter = RateLimiter(rate_limit)
+        # fails calls fast while the instance is down instead of letting them pile up on timeouts
+        self.breaker = CircuitBreaker(name, failure_threshold=failure_threshold, reset_timeout=retry_interval)
+        # search results are shared by every command bound to this instance
+        self.lookup_cache = TTLCache(maxsize=lookup_cache_size, ttl=lookup_cache_ttl, stale_ttl=lookup_cache_stale_ttl)
+        # titles from the library and from recent lookups, used for autocomplete
+        self.title_index = TitleIndex()
+        self.library = LibraryIndex(instance_type)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=type(api).__name__)
+
+        # size the connection pool so every worker can keep its own connection alive
+        adapter = TimeoutHTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, timeout=timeout)
+        api.session.mount("http://", adapter)
+        api.session.mount("https://", adapter)
+
+        self.quality_profiles: dict[str, int] = {}
+        self.root_folders: set[str] = set()
+        # False until quality profiles and root folders were fetched once, the instance may be down at startup
+        self.metadata_loaded = False
+
+    def load_metadata(self):
+        """Fetches quality profiles and root folders. This blocks, so only call it before the event loop starts"""
+        self.quality_profiles = {profile["name"]: profile["id"] for profile in self.api.get_quality_profile()}
+        self.root_folders = {folder["path"].rstrip("/") for folder in self.api.get_root_folder()}
+        self.metadata_loaded = True
+
+    async def refresh_metadata(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.load_metadata)
+
+    def validate_command(self, quality_profile: str, root_folder_path: str):
+        """Raises if a command references a quality profile or root folder that doesn't exist on this instance"""
+        if quality_profile not in self.quality_profiles:
+            raise Exception(f"Quality profile \"{quality_profile}\" not found. Available profiles: {', '.join(self.quality_profiles)}")
+        if root_folder_path.rstrip("/") not in self.root_folders:
+            raise Exception(f"Root folder \"{root_folder_path}\" not found. Available root folders: {', '.join(self.root_folders)}")
+
+    def record_change(self, item: dict):
+        """Updates the library index from an add/update response and drops the cached lookups that show the item,
+        lookup results still carry the state from before the change"""
+        self.library.update(item)
+        media_id = item.get(self.library.id_field)
+        self.lookup_cache.discard_where(lambda results: any(result.get(self.library.id_field) == media_id for result in results))
+
+    def __getattr__(self, name: str):
+        method = getattr(self.api, name)
+
+        async def call(*args, **kwargs):
+            with metrics.arr_request_seconds.time(self.name, name):
+                self.breaker.before_call()
+                loop = asyncio.get_running_loop()
+                try:
+                    # a half-open probe cancelled while waiting for the rate limiter has to be abandoned as well
+                    await self.rate_limiter.acquire()
+                    result = await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+                except OUTAGE_ERRORS:
+                    metrics.arr_request_errors.inc(self.name, name)
+                    self.breaker.record_failure()
+                    raise
+                except Exception:
+                    # the instance answered, the request itself was wrong
+                    metrics.arr_request_errors.inc(self.name, name)
+                    self.breaker.record_success()
+                    raise
+                except asyncio.CancelledError:
+                    self.breaker.abandon()
+                    raise
+
+                self.breaker.record_success()
+                return result
+
+        return call
@@ -0,0 +1,66 @@
+import re
+from collections import Counter, defaultdict
+from typing import Iterable
+
+MAX_CHOICES = 25
+MIN_SCORE = 0.5
+
+
+def normalize_title(title: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", title.casefold()).split())
+
+
+def query_trigrams(text: str) -> list[str]:
+    # leading padding lets one and two character queries match the start of a title
+    padded = f"  {text}"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class TitleIndex:
+    """In-memory trigram index of titles used to answer autocomplete without calling the Arr API.
+
+    Titles are keyed by tmdbId/tvdbId so refreshing from the library only indexes titles that are new.
+    """
+
+    def __init__(self):
+        self.titles: dict[int, tuple[str, str, str]] = {} # id -> (normalized title, title, display name)
+        self.postings: defaultdict[str, set[int]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def add(self, media_id: int, title: str, year: int = None):
+        if media_id in self.titles:
+            return
+
+        normalized = normalize_title(title)
+        self.titles[media_id] = (normalized, title, f"{title} ({year})" if year else title)
+        for trigram in set(query_trigrams(normalized + " ")):
+            self.postings[trigram].add(media_id)
+
+    def update(self, entries: Iterable[dict], id_field: str):
+        for entry in entries:
+            if entry.get(id_field) and entry.get("title"):
+                self.add(entry[id_field], entry["title"], entry.get("year"))
+
+    def search(self, query: str, limit: int = MAX_CHOICES) -> list[tuple[str, str]]:
+        """Returns (display name, title) pairs ranked by how many of the query's trigrams they share"""
+        normalized = normalize_title(query)
+        if not normalized:
+            return []
+
+        trigrams = query_trigrams(normalized)
+        scores = Counter()
+        for trigram in trigrams:
+            scores.update(self.postings.get(trigram, ()))
+
+        matches = []
+        for media_id, score in scores.items():
+            if score / len(trigrams) < MIN_SCORE:
+                continue
+            normalized_title, title, display = self.titles[media_id]
+            # full prefix matches first, then by score, then shorter titles
+            matches.append((not normalized_title.startswith(normalized), -score, len(normalized_title), display, title))
+
+        matches.sort()
+        return [(display, title) for *_, display, title in matches[:limit]]
@@ -0,0 +1,112 @@
+"""Measures the heap used per pending notification agent.
+
+Compares the previous representation (the full lookup result and a live discord.Embed per agent)
+with the compact one (ids, title and the serialized embed). Run from the repository root:
+
+    python benchmarks/agent_memory.py [agents]
+"""
+import copy
+import os
+import sys
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Optional
+
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notifications import NotificationAgent, pack_embed
+
+
+@dataclass
+class LegacyNotificationAgent:
+    instance_type: str
+    notified_members: dict[int, set[int]] = field(default_factory=dict)
+    embed: discord.Embed = None
+    info: dict = None
+    season: Optional[int] = None
+    instance: str = None
+
+
+def lookup_result(media_id: int, seasons: int) -> dict:
+    """A Sonarr lookup result of roughly the size the API returns for a long running series"""
+    return {
+        "title": f"Series {media_id}",
+        "sortTitle": f"series {media_id}",
+        "status": "continuing",
+        "overview": "A long enough overview to be representative of what TVDB returns for a series. " * 4,
+        "network": "Network",
+        "airTime": "21:00",
+        "images": [{"coverType": cover, "url": f"/MediaCover/{media_id}/{cover}.jpg", "remoteUrl": f"https://artworks.thetvdb.com/banners/{media_id}/{cover}.jpg"} for cover in ("banner", "poster", "fanart")],
+        "remotePoster": f"https://artworks.thetvdb.com/banners/{media_id}/poster.jpg",
+        "seasons": [{"seasonNumber": number, "monitored": True, "statistics": {"episodeFileCount": 10, "episodeCount": 10, "totalEpisodeCount": 10, "sizeOnDisk": 12345678900, "percentOfEpisodes": 100.0}} for number in range(seasons)],
+        "year": 2010,
+        "path": f"/tv/Series {media_id}",
+        "qualityProfileId": 1,
+        "languageProfileId": 1,
+        "seasonFolder": True,
+        "monitored": True,
+        "runtime": 45,
+        "tvdbId": media_id,
+        "tvRageId": 0,
+        "tvMazeId": media_id,
+        "imdbId": f"tt{media_id:07d}",
+        "titleSlug": f"series-{media_id}",
+        "certification": "TV-14",
+        "genres": ["Drama", "Crime", "Thriller"],
+        "tags": [],
+        "added": "2023-01-01T00:00:00Z",
+        "ratings": {"votes": 1234, "value": 8.5},
+        "statistics": {"seasonCount": seasons, "episodeFileCount": 10 * seasons, "episodeCount": 10 * seasons, "sizeOnDisk": 12345678900 * seasons, "percentOfEpisodes": 100.0},
+    }
+
+
+def build_embed(series: dict) -> discord.Embed:
+    embed = discord.Embed(title=f"{series['title']} ({series['year']})", url=f"https://www.imdb.com/title/{series['imdbId']}", description=series["overview"], color=0x00ff00)
+    embed.set_image(url=series["remotePoster"])
+    embed.add_field(name="Network", value=series["network"], inline=True)
+    embed.add_field(name="Seasons", value=series["statistics"]["seasonCount"], inline=True)
+    return embed
+
+
+def members() -> dict[int, set[int]]:
+    return {123456789012345678: {234567890123456789, 345678901234567890}}
+
+
+def measure(build, count: int) -> int:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    agents = [build(media_id) for media_id in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del agents
+    return size // count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seasons = 8
+
+    # each lookup is built before measuring so only what the agent keeps alive is counted
+    results = [lookup_result(media_id, seasons) for media_id in range(count)]
+    embeds = [build_embed(result) for result in results]
+
+    def legacy(media_id: int) -> LegacyNotificationAgent:
+        # agents kept the result and the embed after the view that created them was gone
+        return LegacyNotificationAgent(instance_type="Sonarr", notified_members=members(), embed=copy.deepcopy(embeds[media_id]), info=copy.deepcopy(results[media_id]), season=1)
+
+    def compact(media_id: int) -> NotificationAgent:
+        return NotificationAgent(instance_type="Sonarr", media_id=media_id, title=results[media_id]["title"], season=1, notified_members=members(), embed=pack_embed(embeds[media_id]))
+
+    legacy_size = measure(legacy, count)
+    compact_size = measure(compact, count)
+    print(f"{count} agents, {seasons} seasons per series")
+    print(f"legacy  | {legacy_size:>7} bytes per agent")
+    print(f"compact | {compact_size:>7} bytes per agent ({legacy_size / compact_size:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Stand-in Radarr/Sonarr servers and a fake Discord layer for the load test scenarios.
+
+The fake servers speak just enough of the v3 API for pyarr and run on their own thread and event loop,
+so their work doesn't show up in the bot's latencies. Every request is counted by method and route.
+"""
+import asyncio
+import datetime
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from arr import ArrClient
+from pyarr import RadarrAPI, SonarrAPI
+
+SEASONS = 5
+EPISODES = 10
+DOWNLOAD_SIZE = 4_000_000_000
+
+
+class FakeArr:
+    """A Radarr or Sonarr server over a generated catalog.
+
+    The first `library_size` catalog items are in the library, `downloaded` of them already available.
+    Every queue request completes `churn` of the queued downloads and starts as many new ones.
+    """
+
+    def __init__(self, instance_type: str, catalog_size: int = 20000, library_size: int = 5000, downloaded: float = 0.8, queued: float = 0.1, churn: float = 0.05, latency: float = 0.02):
+        self.instance_type = instance_type
+        self.id_field = "tmdbId" if instance_type == "Radarr" else "tvdbId"
+        self.latency = latency
+        self.churn = churn
+        self.calls: Counter[str] = Counter()
+        self.catalog = [self.item(index) for index in range(catalog_size)]
+        self.by_media_id = {item[self.id_field]: item for item in self.catalog}
+        self.library: dict[int, dict] = {}
+        self.queue: dict[int, float] = {} # media id -> fraction downloaded
+
+        for item in self.catalog[:library_size]:
+            self.add(item, available=random.random() < downloaded)
+        pending = [media_id for media_id in self.library if not self.available(self.library[media_id])]
+        for media_id in random.sample(pending, int(len(pending) * queued)):
+            self.queue[media_id] = random.random()
+
+    def item(self, index: int) -> dict:
+        item = {
+            "title": f"{'Movie' if self.instance_type == 'Radarr' else 'Series'} {index}",
+            "year": 1990 + index % 35,
+            "overview": "An overview long enough to be representative of what the metadata providers return. " * 3,
+            "remotePoster": f"https://image.tmdb.org/t/p/original/{index}.jpg",
+            "ratings": {},
+            "monitored": False,
+        }
+        if self.instance_type == "Radarr":
+            item.update(tmdbId=100000 + index, imdbId=f"tt{index:07d}", hasFile=False, isAvailable=True)
+        else:
+            item.update(tvdbId=200000 + index, seasons=[{"seasonNumber": number, "monitored": False} for number in range(SEASONS + 1)])
+        return item
+
+    def add(self, item: dict, available: bool = False) -> dict:
+        entry = dict(item, id=len(self.library) + 1, monitored=True)
+        if self.instance_type == "Radarr":
+            entry["hasFile"] = available
+        else:
+            entry["seasons"] = [dict(season, statistics={"episodeCount": EPISODES, "totalEpisodeCount": EPISODES, "episodeFileCount": EPISODES if available else 0, "percentOfEpisodes": 100.0 if available else 0.0}) for season in item["seasons"]]
+            for season in entry["seasons"]:
+                season["monitored"] = season.get("monitored") or season["seasonNumber"] != 0
+        self.library[entry[self.id_field]] = entry
+        return entry
+
+    def available(self, entry: dict) -> bool:
+        if self.instance_type == "Radarr":
+            return entry["hasFile"]
+        return all(season["statistics"]["percentOfEpisodes"] == 100 for season in entry["seasons"] if season["monitored"])
+
+    def complete(self, media_id: int):
+        self.queue.pop(media_id, None)
+        entry = self.library[media_id]
+        if self.instance_type == "Radarr":
+            entry["hasFile"] = True
+        else:
+            for season in entry["seasons"]:
+                season["statistics"].update(episodeFileCount=EPISODES, percentOfEpisodes=100.0)
+
+    def lookup_result(self, item: dict) -> dict:
+        # lookups only carry an id for items already in the library
+        return dict(self.library.get(item[self.id_field], item))
+
+    def queue_records(self) -> list[dict]:
+        finished = random.sample(list(self.queue), int(len(self.queue) * self.churn))
+        for media_id in finished:
+            self.complete(media_id)
+        pending = [media_id for media_id, entry in self.library.items() if media_id not in self.queue and not self.available(entry)]
+        for media_id in random.sample(pending, min(len(finished), len(pending))):
+            self.queue[media_id] = 0.0
+
+        records = []
+        eta = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=20)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        for media_id, done in self.queue.items():
+            self.queue[media_id] = min(0.99, done + 0.05)
+            record = {"id": len(records) + 1, "downloadId": f"download-{media_id}", "size": DOWNLOAD_SIZE, "sizeleft": DOWNLOAD_SIZE * (1 - done), "status": "downloading", "trackedDownloadState": "downloading", "estimatedCompletionTime": eta}
+            if self.instance_type == "Radarr":
+                records.append(dict(record, movieId=self.library[media_id]["id"]))
+            else:
+                # one record per episode of a season pack, as Sonarr reports them
+                for episode in range(EPISODES):
+                    records.append(dict(record, id=len(records) + 1, seriesId=self.library[media_id]["id"], seasonNumber=1, episode={"seasonNumber": 1, "episodeNumber": episode + 1}))
+        return records
+
+    def app(self) -> web.Application:
+        kind = "movie" if self.instance_type == "Radarr" else "series"
+        id_param = "tmdbid" if self.instance_type == "Radarr" else "tvdbId"
+
+        @web.middleware
+        async def count_and_delay(request: web.Request, handler):
+            self.calls[f"{request.method} {request.match_info.route.resource.canonical}"] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+            return await handler(request)
+
+        async def quality_profiles(request):
+            return web.json_response([{"id": 1, "name": "Any"}])
+
+        async def root_folders(request):
+            return web.json_response([{"id": 1, "path": "/media"}])
+
+        async def library(request):
+            if id_param in request.query:
+                entry = self.library.get(int(request.query[id_param]))
+                return web.json_response([entry] if entry else [])
+            return web.json_response(list(self.library.values()))
+
+        async def lookup(request):
+            term = request.query.get("term", "").casefold()
+            matches = [self.lookup_result(item) for item in self.catalog if term in item["title"].casefold()]
+            return web.json_response(matches[:50])
+
+        async def add(request):
+            item = await request.json()
+            entry = self.library.get(item[self.id_field]) or self.add(self.by_media_id[item[self.id_field]])
+            self.queue.setdefault(entry[self.id_field], 0.0)
+            return web.json_response(entry, status=201)
+
+        async def import_items(request):
+            return web.json_response([self.add(self.by_media_id[item[self.id_field]]) for item in await request.json()])
+
+        async def update(request):
+            item = await request.json()
+            entry = self.library[item[self.id_field]]
+            entry["monitored"] = item["monitored"]
+            for season, updated in zip(entry.get("seasons", []), item.get("seasons", [])):
+                season["monitored"] = updated["monitored"]
+            return web.json_response(entry, status=202)
+
+        async def command(request):
+            return web.json_response(dict(await request.json(), id=1, status="queued"), status=201)
+
+        async def queue(request):
+            records = self.queue_records()
+            return web.json_response({"page": 1, "pageSize": len(records), "totalRecords": len(records), "records": records})
+
+        app = web.Application(middlewares=[count_and_delay])
+        app.router.add_get("/api/v3/qualityprofile", quality_profiles)
+        app.router.add_get("/api/v3/rootfolder", root_folders)
+        app.router.add_get(f"/api/v3/{kind}", library)
+        app.router.add_get(f"/api/v3/{kind}/lookup", lookup)
+        app.router.add_post(f"/api/v3/{kind}", add)
+        app.router.add_post("/api/v3/movie/import", import_items)
+        app.router.add_put(f"/api/v3/{kind}", update)
+        app.router.add_post("/api/v3/command", command)
+        app.router.add_get("/api/v3/queue", queue)
+        return app
+
+    def start(self) -> str:
+        """Serves the fake API from a background thread and returns its URL"""
+        ready = threading.Event()
+        url = []
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            runner = web.AppRunner(self.app(), access_log=None)
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            loop.run_until_complete(site.start())
+            url.append(f"http://127.0.0.1:{runner.addresses[0][1]}")
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+        return url[0]
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, channel: "FakeChannel"):
+        self.id = message_id
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        await asyncio.sleep(self.channel.latency)
+        self.channel.edits += 1
+
+
+class FakeChannel:
+    """Records every message sent to it with the time it was sent"""
+
+    def __init__(self, channel_id: int, latency: float):
+        self.id = channel_id
+        self.latency = latency
+        self.sent: list[tuple[float, str]] = []
+        self.edits = 0
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        self.sent.append((time.perf_counter(), content))
+        return FakeMessage(random.getrandbits(60), self)
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(message_id, self)
+
+
+class FakeClient:
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.channels: dict[int, FakeChannel] = {}
+
+    def get_channel(self, channel_id: int) -> FakeChannel:
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(channel_id, self.latency)
+        return self.channels[channel_id]
+
+    async def fetch_channel(self, channel_id: int) -> FakeChannel:
+        return self.get_channel(channel_id)
+
+    def sent(self) -> list[tuple[float, str]]:
+        return [message for channel in self.channels.values() for message in channel.sent]
+
+    def edits(self) -> int:
+        return sum(channel.edits for channel in self.channels.values())
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.acknowledged_at: Optional[float] = None
+
+    def is_done(self) -> bool:
+        return self.acknowledged_at is not None
+
+    def acknowledge(self):
+        if self.acknowledged_at is None:
+            self.acknowledged_at = time.perf_counter()
+
+    async def defer(self, **kwargs):
+        self.acknowledge()
+
+    async def edit_message(self, **kwargs):
+        self.acknowledge()
+
+    async def send_message(self, *args, **kwargs):
+        self.acknowledge()
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs) -> FakeMessage:
+        message = await self.interaction.channel.send(*args, **kwargs)
+        self.interaction.message = self.interaction.message or message
+        return message
+
+
+class FakeInteraction:
+    """Just the parts of discord.Interaction the command and view callbacks use"""
+
+    def __init__(self, user_id: int, channel: FakeChannel, message: Optional[FakeMessage] = None):
+        self.user = FakeUser(user_id)
+        self.channel = channel
+        self.channel_id = channel.id
+        self.message = message
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.created_at = time.perf_counter()
+
+    @property
+    def response_latency(self) -> Optional[float]:
+        """Seconds until the interaction was acknowledged, Discord allows 3"""
+        return self.response.acknowledged_at - self.created_at if self.response.acknowledged_at else None
+
+
+def start_instance(fake: FakeArr, rate_limit: float = 0, max_workers: int = 8) -> ArrClient:
+    """Starts the fake server and registers an ArrClient for it with main, as create_instances would"""
+    url = fake.start()
+    api_class = RadarrAPI if fake.instance_type == "Radarr" else SonarrAPI
+    instance = ArrClient(api_class(url, "benchmark"), name=fake.instance_type, instance_type=fake.instance_type, max_workers=max_workers, rate_limit=rate_limit)
+    instance.load_metadata()
+    main.instances[instance.name] = instance
+    return instance
+
+
+def use_fake_discord(client: FakeClient, batch_window: float = 0, progress_interval: float = 1):
+    main.dispatcher.client = client
+    main.dispatcher.window = batch_window
+    main.progress.client = client
+    main.progress.interval = progress_interval
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def report(title: str, latencies: dict[str, list[float]], elapsed: float, operations: int, calls: Counter, extra: Optional[dict[str, object]] = None):
+    print(f"\n{title}")
+    print(f"  {operations} operations in {elapsed:.2f}s | {operations / elapsed:.1f}/s")
+    for name, values in latencies.items():
+        if values:
+            print(f"  {name:<24} p50 {percentile(values, 50) * 1000:8.1f}ms | p99 {percentile(values, 99) * 1000:8.1f}ms | max {max(values) * 1000:8.1f}ms | mean {statistics.fmean(values) * 1000:8.1f}ms")
+    print(f"  API calls: {sum(calls.values())}")
+    for route, count in calls.most_common():
+        print(f"    {route:<32} {count}")
+    for name, value in (extra or {}).items():
+        print(f"  {name}: {value}")
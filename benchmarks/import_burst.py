@@ -0,0 +1,67 @@
+"""A burst of import webhooks arriving at once, e.g. a season pack or a download client catching up.
+
+Each event goes through handle_webhook, which refetches the item and announces the requests it completes.
+Reports how long each event took to handle and how long after the burst started each notification was sent.
+Run from the repository root:
+
+    python benchmarks/import_burst.py --events 1000 --type sonarr
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from harness import FakeArr, FakeClient, main, report, start_instance, use_fake_discord
+from notifications import NotificationAgent, notification_agents
+
+
+async def run(args):
+    fake = FakeArr(args.type.title(), catalog_size=args.events, library_size=args.events, downloaded=0, queued=0, latency=args.latency)
+    instance = start_instance(fake, rate_limit=args.rate_limit)
+    client = FakeClient(latency=args.discord_latency)
+    use_fake_discord(client, batch_window=args.batch_window)
+    fake.calls.clear()
+
+    payloads = []
+    for media_id, entry in fake.library.items():
+        season = None if instance.instance_type == "Radarr" else 1
+        agent = NotificationAgent(instance_type=instance.instance_type, media_id=media_id, title=entry["title"], season=season, instance=instance.name)
+        agent.notified_members[random.randrange(args.channels)] = {random.getrandbits(60)}
+        await notification_agents.add(agent)
+
+        if instance.instance_type == "Radarr":
+            payloads.append({"eventType": "Download", "movie": {"tmdbId": media_id}})
+        else:
+            payloads.append({"eventType": "Download", "series": {"tvdbId": media_id}, "episodes": [{"seasonNumber": 1}]})
+        fake.complete(media_id)
+
+    latencies = {"webhook": [], "notification sent": []}
+
+    async def deliver(payload: dict):
+        event_start = time.perf_counter()
+        await main.handle_webhook(payload)
+        latencies["webhook"].append(time.perf_counter() - event_start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(deliver(payload) for payload in payloads))
+    elapsed = time.perf_counter() - start
+
+    await asyncio.sleep(args.batch_window + 1)
+    latencies["notification sent"] = [sent_at - start for sent_at, _ in client.sent()]
+
+    report(f"import_burst | {args.events} {args.type} imports at once", latencies, elapsed, args.events, fake.calls, {
+        "requests announced": args.events - len(notification_agents),
+        "notification messages sent": len(client.sent()),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--type", choices=["radarr", "sonarr"], default="radarr")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean Arr API latency in seconds")
+    parser.add_argument("--discord-latency", type=float, default=0.05)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--batch-window", type=float, default=2, help="NOTIFICATION_BATCH_WINDOW")
+    parser.add_argument("--rate-limit", type=float, default=0)
+    asyncio.run(run(parser.parse_args()))
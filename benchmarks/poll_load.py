@@ -0,0 +1,68 @@
+"""Thousands of pending requests being checked by the download poller.
+
+Every cycle checks all pending requests at once, the worst case for check_downloads, while the fake queue
+completes and starts downloads between cycles. Run from the repository root:
+
+    python benchmarks/poll_load.py --agents 5000 --cycles 20 --type sonarr
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from harness import FakeArr, FakeClient, main, report, start_instance, use_fake_discord
+from notifications import NotificationAgent, notification_agents
+
+
+async def run(args):
+    # every pending request is in the library, not yet available, some of them downloading
+    fake = FakeArr(args.type.title(), catalog_size=args.agents, library_size=args.agents, downloaded=0, queued=args.queued, churn=args.churn, latency=args.latency)
+    instance = start_instance(fake, rate_limit=args.rate_limit)
+    client = FakeClient(latency=args.discord_latency)
+    use_fake_discord(client, progress_interval=args.progress_interval)
+    fake.calls.clear()
+
+    for media_id, entry in fake.library.items():
+        # the fake queue downloads season 1 of a series
+        agent = NotificationAgent(instance_type=instance.instance_type, media_id=media_id, title=entry["title"], season=None if instance.instance_type == "Radarr" else 1, instance=instance.name)
+        channel_id = random.randrange(args.channels)
+        agent.notified_members[channel_id] = {random.getrandbits(60) for _ in range(args.members)}
+        agent.messages[random.getrandbits(60)] = channel_id
+        await notification_agents.add(agent)
+
+    latencies = {"cycle": []}
+    checked = 0
+    start = time.perf_counter()
+    for _ in range(args.cycles):
+        agents = list(notification_agents.agents.values())
+        cycle_start = time.perf_counter()
+        await main.check_instance(instance.name, agents)
+        latencies["cycle"].append(time.perf_counter() - cycle_start)
+        checked += len(agents)
+    elapsed = time.perf_counter() - start
+
+    # let the dispatcher and progress tracker flush what the last cycle queued
+    await asyncio.sleep(max(main.dispatcher.window, args.progress_interval) + 1)
+
+    report(f"poll_load | {args.agents} pending {args.type} requests, {args.cycles} cycles", latencies, elapsed, checked, fake.calls, {
+        "API calls per cycle": f"{sum(fake.calls.values()) / args.cycles:.1f}",
+        "requests completed": args.agents - len(notification_agents),
+        "notification messages sent": len(client.sent()),
+        "progress edits": client.edits(),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=2000)
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--type", choices=["radarr", "sonarr"], default="radarr")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean Arr API latency in seconds")
+    parser.add_argument("--discord-latency", type=float, default=0.05)
+    parser.add_argument("--queued", type=float, default=0.2, help="fraction of the requests downloading at the start")
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of the queue completing per cycle")
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--members", type=int, default=2, help="users waiting on each request")
+    parser.add_argument("--progress-interval", type=float, default=1)
+    parser.add_argument("--rate-limit", type=float, default=0)
+    asyncio.run(run(parser.parse_args()))
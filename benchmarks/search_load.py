@@ -0,0 +1,95 @@
+"""N users concurrently searching, picking a result and requesting it.
+
+Runs the same code path as a slash command: the lookup, the select menu callback and the request button
+callback, against a stand-in Radarr/Sonarr. Run from the repository root:
+
+    python benchmarks/search_load.py --users 200 --type sonarr --latency 0.05
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import discord
+
+from harness import FakeArr, FakeClient, FakeInteraction, report, start_instance, use_fake_discord
+from radarr import MovieSelectView, get_movie
+from sonarr import SeriesSelectView, get_series
+
+
+async def request_flow(instance, title: str, user_id: int, channel, latencies: dict[str, list[float]]):
+    # the slash command
+    interaction = FakeInteraction(user_id, channel)
+    await interaction.response.defer(thinking=True)
+    if instance.instance_type == "Radarr":
+        entries = await get_movie(title, instance)
+        view = MovieSelectView(movies_found=entries, radarr_instance=instance, quality_profile="Any", root_folder_path="/media")
+    else:
+        entries = await get_series(title, instance)
+        view = SeriesSelectView(series_found=entries, sonarr_instance=instance, quality_profile="Any", root_folder_path="/media")
+    message = await interaction.followup.send("Select an item", view=view)
+    latencies["search"].append(time.perf_counter() - interaction.created_at)
+
+    # picking the first result
+    select = view.children[0]
+    select._values = ["0"]
+    interaction = FakeInteraction(user_id, channel, message)
+    await select.callback(interaction)
+    latencies["select"].append(time.perf_counter() - interaction.created_at)
+    latencies["select (acknowledged)"].append(interaction.response_latency)
+
+    if instance.instance_type == "Sonarr":
+        season_select = next(item for item in view.children if isinstance(item, discord.ui.Select) and item is not select)
+        season_select._values = ["all"]
+        interaction = FakeInteraction(user_id, channel, message)
+        await season_select.callback(interaction)
+        latencies["season select"].append(time.perf_counter() - interaction.created_at)
+
+    # requesting it, if it isn't already available or requested
+    button = next((item for item in view.children if hasattr(item, "callback") and type(item).__name__.startswith("Request")), None)
+    if button:
+        interaction = FakeInteraction(user_id, channel, message)
+        await button.callback(interaction)
+        latencies["request"].append(time.perf_counter() - interaction.created_at)
+
+
+async def run(args):
+    fake = FakeArr(args.type.title(), catalog_size=args.catalog, library_size=args.library, latency=args.latency)
+    instance = start_instance(fake, rate_limit=args.rate_limit, max_workers=args.workers)
+    client = FakeClient(latency=args.discord_latency)
+    use_fake_discord(client)
+    if args.warm_library:
+        items = await (instance.get_movie() if instance.instance_type == "Radarr" else instance.get_series())
+        instance.library.replace(items)
+    fake.calls.clear()
+
+    # users search for a limited set of titles, so some of them share the lookup cache
+    prefix = "Movie" if instance.instance_type == "Radarr" else "Series"
+    titles = [f"{prefix} {random.randrange(args.catalog)}" for _ in range(args.distinct_titles)]
+    latencies = {"search": [], "select": [], "select (acknowledged)": [], "season select": [], "request": []}
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request_flow(instance, random.choice(titles), user_id, client.get_channel(user_id % args.channels), latencies) for user_id in range(args.users)))
+    elapsed = time.perf_counter() - start
+
+    late = sum(1 for latency in latencies["select (acknowledged)"] if latency > 3)
+    report(f"search_load | {args.users} users, {args.type}, {args.latency * 1000:.0f}ms API latency", latencies, elapsed, args.users, fake.calls, {
+        "lookup cache": instance.lookup_cache.stats(),
+        "interactions acknowledged after 3s": late,
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--type", choices=["radarr", "sonarr"], default="radarr")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean Arr API latency in seconds")
+    parser.add_argument("--discord-latency", type=float, default=0.05)
+    parser.add_argument("--catalog", type=int, default=20000)
+    parser.add_argument("--library", type=int, default=5000)
+    parser.add_argument("--distinct-titles", type=int, default=50)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--rate-limit", type=float, default=0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--warm-library", action="store_true", help="load the library index first, as refresh_libraries does")
+    asyncio.run(run(parser.parse_args()))
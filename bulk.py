@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import re
+from typing import Optional
+
+import discord
+
+from arr import ArrClient, missing_profile_message
+from autocomplete import normalize_title
+from radarr import bulk_request_movies, get_movie
+from sonarr import bulk_request_series, get_series
+
+MAX_CONTENT_LENGTH = 2000
+
+ID_TERM = re.compile(r"^(tmdb|tvdb|imdb):\s*(\S+)$", re.IGNORECASE)
+# only a parenthesized year is read as one, "Blade Runner 2049" is a title
+YEAR_SUFFIX = re.compile(r"^(.+?)\s*\(((?:19|20)\d{2})\)$")
+
+
+def parse_titles(text: str) -> list[str]:
+    """Splits a list of titles on new lines and semicolons, dropping blanks and duplicates"""
+    titles = [title.strip() for title in re.split(r"[\n;]", text)]
+    return list(dict.fromkeys(title for title in titles if title))
+
+
+def pick_match(term: str, results: list[dict]) -> Optional[dict]:
+    """Picks the result that exactly matches an id or a title (and year), or None if nothing does"""
+    id_match = ID_TERM.match(term)
+    if id_match:
+        kind, value = id_match.groups()
+        return next((result for result in results if str(result.get(f"{kind.lower()}Id")) == value), None)
+
+    # some titles end in a year themselves, like "Doctor Who (2005)"
+    exact = [result for result in results if normalize_title(result["title"]) == normalize_title(term)]
+    if exact:
+        return exact[0]
+
+    year_match = YEAR_SUFFIX.match(term)
+    if not year_match:
+        return None
+
+    title, year = year_match.group(1), int(year_match.group(2))
+    return next((result for result in results if normalize_title(result["title"]) == normalize_title(title) and result.get("year") == year), None)
+
+
+def lookup_term(term: str) -> str:
+    return term.replace(" ", "") if ID_TERM.match(term) else term
+
+
+def format_summary(summary: dict[str, list[str]], total: int) -> str:
+    lines = [f"**Bulk request** | {total} title(s)"]
+    for status, titles in summary.items():
+        if titles:
+            lines.append(f"**{status} ({len(titles)}):** {', '.join(titles)}")
+
+    content = "\n".join(lines)
+    if len(content) > MAX_CONTENT_LENGTH:
+        content = content[:MAX_CONTENT_LENGTH - 5] + "(...)"
+    return content
+
+
+async def bulk_request(terms: list[str], instance: ArrClient, quality_profile: str, root_folder_path: str, interaction: discord.Interaction, concurrency: int) -> str:
+    """Looks up every term concurrently, requests the exact matches and returns a summary message"""
+    quality_profile_id = instance.quality_profiles.get(quality_profile)
+    if quality_profile_id is None:
+        return missing_profile_message(instance, quality_profile)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    lookup = get_movie if instance.instance_type == "Radarr" else get_series
+
+    async def resolve(term: str) -> Optional[dict]:
+        async with semaphore:
+            try:
+                results = await lookup(lookup_term(term), instance)
+            except Exception:
+                logging.exception(f"Failed to look up {term}")
+                return None
+
+        return pick_match(term, results)
+
+    matches = await asyncio.gather(*(resolve(term) for term in terms))
+
+    # the same title can be listed twice under different spellings
+    found = {}
+    not_found = []
+    for term, match in zip(terms, matches):
+        if match:
+            found.setdefault(match["tmdbId" if instance.instance_type == "Radarr" else "tvdbId"], match)
+        else:
+            not_found.append(term)
+
+    try:
+        if instance.instance_type == "Radarr":
+            summary = await bulk_request_movies(list(found.values()), instance, quality_profile_id, root_folder_path, interaction)
+        else:
+            summary = await bulk_request_series(list(found.values()), instance, quality_profile_id, root_folder_path, interaction, concurrency)
+    except Exception:
+        logging.exception(f"Failed to bulk request {len(found)} title(s) from {instance.name}")
+        summary = {"Failed": [match["title"] for match in found.values()]}
+
+    summary["No exact match"] = not_found
+    return format_summary(summary, len(terms))
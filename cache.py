@@ -0,0 +1,79 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+def normalize_term(term: str) -> str:
+    return " ".join(term.casefold().split())
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after `ttl` seconds.
+
+    Concurrent misses for the same key share a single load instead of each hitting the backend.
+    For `stale_ttl` seconds after expiring, an entry is still returned straight away while it is reloaded
+    in the background, so callers keep getting results while the backend is slow or down.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600, stale_ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.pending: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale = 0
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry and entry[0] > now:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        if entry and entry[0] + self.stale_ttl > now:
+            self.entries.move_to_end(key)
+            self.stale += 1
+            if key not in self.pending:
+                self._load(key, load)
+            return entry[1]
+
+        task = self.pending.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._load(key, load)
+
+        # shield so a cancelled caller doesn't cancel the load for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    def _load(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.create_task(load())
+        self.pending[key] = task
+        task.add_done_callback(lambda done: self._store(key, done))
+        return task
+
+    def _store(self, key: Hashable, task: asyncio.Task):
+        self.pending.pop(key, None)
+        if task.cancelled() or task.exception():
+            return
+
+        self.entries[key] = (time.monotonic() + self.ttl, task.result())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def discard_where(self, predicate: Callable[[Any], bool]) -> int:
+        """Drops every entry whose value matches, returns how many were dropped"""
+        keys = [key for key, (_, value) in self.entries.items() if predicate(value)]
+        for key in keys:
+            del self.entries[key]
+        return len(keys)
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "stale": self.stale}
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import discord
+
+import metrics
+
+MAX_CONTENT_LENGTH = 2000
+MAX_EMBEDS = 10
+MAX_ATTEMPTS = 5
+
+
+@dataclass
+class Completion:
+    title: str
+    member_ids: set[int]
+    embed: Optional[discord.Embed] = None
+    # called with whether every line of the completion was sent
+    on_done: Optional[Callable[[bool], Awaitable[None]]] = None
+
+
+def completion_lines(completion: Completion) -> list[str]:
+    """Formats a completion, splitting the mentions over several lines if they don't fit in one message"""
+    suffix = f"**{completion.title}** has finished downloading!"
+    lines = []
+    line = ""
+    for mention in (f"<@{member_id}>" for member_id in completion.member_ids):
+        if len(line) + len(mention) + len(suffix) + 2 > MAX_CONTENT_LENGTH:
+            lines.append(f"{line} {suffix}")
+            line = ""
+        line = f"{line} {mention}" if line else mention
+
+    lines.append(f"{line} {suffix}" if line else suffix)
+    return lines
+
+
+class NotificationDispatcher:
+    """Delivers completion messages off the polling path.
+
+    Completions for the same channel that arrive within `window` seconds are merged into as few
+    messages as the content and embed limits allow, and each channel is sent to concurrently.
+    Every completion reports through `on_done` whether it was delivered, so a failed one can be announced again.
+    """
+
+    def __init__(self, client: discord.Client, window: float = 2):
+        self.client = client
+        self.window = window
+        self.pending: defaultdict[int, list[Completion]] = defaultdict(list)
+        self.flushers: dict[int, asyncio.Task] = {}
+
+    def enqueue(self, channel_id: int, completion: Completion):
+        self.pending[channel_id].append(completion)
+        if channel_id not in self.flushers:
+            self.flushers[channel_id] = asyncio.create_task(self.flush(channel_id))
+
+    async def flush(self, channel_id: int):
+        await asyncio.sleep(self.window)
+        # anything enqueued after this point starts a new batch
+        completions = self.pending.pop(channel_id, [])
+        del self.flushers[channel_id]
+
+        messages = self.batch(completions)
+        sent = 0
+        try:
+            channel = self.client.get_channel(channel_id) or await self.client.fetch_channel(channel_id)
+            for content, embeds, _ in messages:
+                with metrics.notification_send_seconds.time():
+                    await self.send(channel, content, embeds)
+                sent += 1
+        except Exception:
+            logging.exception(f"Failed to send {len(completions)} notification(s) to channel {channel_id}")
+
+        # a completion with a line in a message that wasn't sent failed, even if its other lines went out
+        failed = {id(completion) for _, _, message_completions in messages[sent:] for completion in message_completions}
+        for completion in completions:
+            if completion.on_done:
+                try:
+                    await completion.on_done(id(completion) not in failed)
+                except Exception:
+                    logging.exception(f"Failed to record the delivery of {completion.title}")
+
+    @staticmethod
+    def batch(completions: list[Completion]) -> list[tuple[str, list[discord.Embed], list[Completion]]]:
+        """Returns the messages to send, each with the completions that have a line in it"""
+        messages = []
+        lines = []
+        embeds = []
+        included = []
+        for completion in completions:
+            new_embeds = [completion.embed] if completion.embed else []
+            for line in completion_lines(completion):
+                content_length = sum(len(existing) + 1 for existing in lines) + len(line)
+                if lines and (content_length > MAX_CONTENT_LENGTH or len(embeds) + len(new_embeds) > MAX_EMBEDS):
+                    messages.append(("\n".join(lines), embeds, included))
+                    lines = []
+                    embeds = []
+                    included = []
+
+                lines.append(line)
+                embeds.extend(new_embeds)
+                new_embeds = []
+                if not included or included[-1] is not completion:
+                    included.append(completion)
+
+        if lines:
+            messages.append(("\n".join(lines), embeds, included))
+        return messages
+
+    async def send(self, channel: discord.abc.Messageable, content: str, embeds: list[discord.Embed]):
+        delay = 1
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                await channel.send(content=content, embeds=embeds)
+                return
+            except discord.RateLimited as e:
+                delay = e.retry_after
+            except discord.HTTPException as e:
+                if attempt == MAX_ATTEMPTS or (e.status != 429 and e.status < 500):
+                    raise
+
+            if attempt == MAX_ATTEMPTS:
+                raise Exception(f"Still rate limited after {MAX_ATTEMPTS} attempts")
+
+            logging.warning(f"Sending notification failed, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay *= 2
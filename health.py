@@ -0,0 +1,57 @@
+import logging
+import time
+from typing import Optional
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an instance that keeps failing"""
+
+
+class CircuitBreaker:
+    """Stops calling an instance after `failure_threshold` consecutive failed calls.
+
+    While open every call fails fast. Once `reset_timeout` seconds have passed a single call is let through
+    as a probe (half-open): if it succeeds the circuit closes, otherwise it stays open for another `reset_timeout`.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.probing or time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        if self.opened_at is None:
+            return
+
+        retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+        if self.probing or retry_in > 0:
+            raise CircuitOpenError(f"{self.name} is unavailable, retrying in {max(retry_in, 0):.0f}s")
+        self.probing = True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logging.info(f"{self.name} is reachable again")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logging.warning(f"{self.name} failed {self.failures} times in a row, pausing calls for {self.reset_timeout}s")
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def abandon(self):
+        """Lets another call probe if the probing call was cancelled before it finished"""
+        self.probing = False
@@ -0,0 +1,66 @@
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+
+@dataclass(slots=True)
+class MovieStatus:
+    has_file: bool
+    monitored: bool
+    id: Optional[int] = None # Radarr's own id, which updates are sent to
+
+
+@dataclass(slots=True)
+class SeriesStatus:
+    monitored: bool
+    seasons: dict[int, tuple[bool, float]] = field(default_factory=dict) # season -> (monitored, percentOfEpisodes)
+    id: Optional[int] = None # Sonarr's own id, which updates are sent to
+
+
+class LibraryIndex:
+    """Download and monitoring status of every item in a Radarr/Sonarr library, keyed by tmdbId/tvdbId.
+
+    Kept current from the library fetches the bot already makes, webhook events and its own requests,
+    so interaction callbacks can answer "available / requested" without a round trip.
+    """
+
+    def __init__(self, instance_type: str):
+        self.instance_type = instance_type
+        self.id_field = "tmdbId" if instance_type == "Radarr" else "tvdbId"
+        self.entries: dict[int, MovieStatus | SeriesStatus] = {}
+        self.loaded = False
+        # while the instance is down the last snapshot keeps being served, this says how old it is
+        self.refreshed_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, media_id: int) -> bool:
+        return media_id in self.entries
+
+    def get(self, media_id: int) -> Optional[MovieStatus | SeriesStatus]:
+        return self.entries.get(media_id)
+
+    def replace(self, items: Iterable[dict]):
+        """Rebuilds the index from a full library listing"""
+        self.entries = {item[self.id_field]: self.status(item) for item in items}
+        self.loaded = True
+        self.refreshed_at = time.monotonic()
+
+    def update(self, item: dict):
+        """Updates a single movie/series from a get, add or update response"""
+        if item and item.get(self.id_field):
+            self.entries[item[self.id_field]] = self.status(item)
+
+    def discard(self, media_id: int):
+        self.entries.pop(media_id, None)
+
+    def status(self, item: dict) -> MovieStatus | SeriesStatus:
+        if self.instance_type == "Radarr":
+            return MovieStatus(has_file=bool(item.get("hasFile")), monitored=bool(item.get("monitored")), id=item.get("id"))
+
+        seasons = {}
+        for season in item.get("seasons", []):
+            statistics = season.get("statistics") or {}
+            seasons[season["seasonNumber"]] = (bool(season.get("monitored")), statistics.get("percentOfEpisodes", 0))
+        return SeriesStatus(monitored=bool(item.get("monitored")), seasons=seasons, id=item.get("id"))
@@ -1,14 +1,30 @@
 import asyncio
+import functools
+import hashlib
+import json
 import logging
 import os
+import re
+import socket
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
 
 import discord
 from pyarr import RadarrAPI, SonarrAPI
 
-from notifications import notification_agents
-from radarr import MovieSelectView, check_movie_downloaded, get_movie
-from sonarr import SeriesSelectView, check_series_season_downloaded, get_series
+import metrics
+from arr import OUTAGE_ERRORS, UNAVAILABLE_ERRORS, ArrClient, unavailable_message
+from bulk import bulk_request, parse_titles
+from dispatcher import Completion, NotificationDispatcher
+from notifications import NotificationAgent, notification_agents
+from progress import ProgressTracker
+from radarr import MovieSelectView, get_movie, get_movie_index, get_queued_movies, movie_downloaded, movie_released
+from sonarr import SeriesSelectView, get_queued_seasons, get_series, get_series_index, season_downloaded, season_released
+from store import AgentStore
+from webhooks import start_webhook_server
 
 
 # setup logging
@@ -24,106 +40,437 @@ class Command:
 
 VERSION = "1.0.0"
 intents = discord.Intents.default()
-client = discord.Client(intents=intents)
+
+# SHARD_IDS runs only some of the shards, so the rest can run in other processes sharing DATABASE_PATH
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(shard_id) for shard_id in os.environ["SHARD_IDS"].split(",")] if os.environ.get("SHARD_IDS") else None
+if SHARD_IDS and not SHARD_COUNT:
+    raise Exception("SHARD_COUNT must be set when SHARD_IDS is set.")
+
+if os.environ.get("SHARDED", "false").lower() == "true" or SHARD_COUNT:
+    client = discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    client = discord.Client(intents=intents)
 tree = discord.app_commands.CommandTree(client)
+dispatcher = NotificationDispatcher(client, window=float(os.environ.get("NOTIFICATION_BATCH_WINDOW", 2)))
+# request messages are edited with the download progress at most once per interval, 0 turns it off
+progress = ProgressTracker(client, interval=float(os.environ.get("PROGRESS_UPDATE_INTERVAL", 30)))
 guild_id = None
 
-radarr = None
-sonarr = None
+# every configured Radarr/Sonarr instance, keyed by name (e.g. "Radarr" or "Radarr 4K")
+instances: dict[str, ArrClient] = {}
+# the request commands of each instance, validated again whenever its metadata is refreshed
+configured_commands: defaultdict[str, list[Command]] = defaultdict(list)
+
+METADATA_REFRESH_INTERVAL = int(os.environ.get("METADATA_REFRESH_INTERVAL", 3600))
+# instances that couldn't be reached at startup are retried this often until they are
+METADATA_RETRY_INTERVAL = 60
+LIBRARY_REFRESH_INTERVAL = int(os.environ.get("LIBRARY_REFRESH_INTERVAL", 900))
+BULK_MAX_TITLES = int(os.environ.get("BULK_MAX_TITLES", 50))
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 5))
+WEBHOOK_PORT = os.environ.get("WEBHOOK_PORT")
+# with webhooks enabled, polling only reconciles imports a webhook may have missed
+POLL_INTERVAL = int(os.environ.get("POLL_INTERVAL", 300 if WEBHOOK_PORT else 5))
+# agents with nothing downloading back off exponentially up to these intervals
+POLL_MAX_INTERVAL = int(os.environ.get("POLL_MAX_INTERVAL", 1800))
+UNRELEASED_POLL_INTERVAL = int(os.environ.get("UNRELEASED_POLL_INTERVAL", 21600))
+# processes sharing the database elect one of them to poll through a lease that expires after POLLER_LEASE_TTL
+SHARED_DATABASE = os.environ.get("SHARED_DATABASE", "true" if SHARD_IDS else "false").lower() == "true"
+POLLER_LEASE_TTL = float(os.environ.get("POLLER_LEASE_TTL", 60))
+LEASE_HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+METRICS_PORT = os.environ.get("METRICS_PORT")
+SUPERVISOR_MAX_DELAY = 300
+# commands are only synced when they changed, this forces a sync e.g. after deleting them by hand
+FORCE_COMMAND_SYNC = os.environ.get("FORCE_COMMAND_SYNC", "false").lower() == "true"
+
+metrics.Gauge("seekarr_pending_requests", "Requests waiting for a download, by instance", ("instance",),
+              collect=lambda: {(name,): count for name, count in notification_agents.counts.items()})
+metrics.Counter("seekarr_lookup_cache_requests_total", "Search lookups by instance and whether they were served from the cache", ("instance", "result"),
+                collect=lambda: {(name, result): getattr(instance.lookup_cache, result) for name, instance in instances.items() for result in ("hits", "misses", "coalesced", "stale")})
+metrics.Gauge("seekarr_arr_circuit_open", "1 while calls to an instance are paused because it keeps failing", ("instance",),
+              collect=lambda: {(name,): int(instance.breaker.state != "closed") for name, instance in instances.items()})
+metrics.Gauge("seekarr_library_age_seconds", "Time since an instance's library snapshot was last fully refreshed", ("instance",),
+              collect=lambda: {(name,): time.monotonic() - instance.library.refreshed_at for name, instance in instances.items() if instance.library.loaded})
+
+async def notify(agent: NotificationAgent):
+    # claim first so a webhook and the poller, of this or another process, can't both announce the same import.
+    # the agent is only deleted once its notifications were sent
+    if not await notification_agents.claim(agent):
+        return
+
+    progress.discard(agent)
+
+    # queue a message for each channel. include all users in message for that given channel
+    for channel_id, members in list(agent.notified_members.items()):
+        member_ids = set(members)
+        dispatcher.enqueue(channel_id, Completion(title=agent.display_title, member_ids=member_ids, embed=agent.build_embed(),
+                                                  on_done=functools.partial(notification_agents.delivered, agent, channel_id, member_ids)))
+
+async def handle_webhook(payload: dict, instance_name: str = None):
+    # ?instance=4K on the webhook URL routes the event to the "Radarr 4K"/"Sonarr 4K" instance
+    instance_type = "Radarr" if "movie" in payload else "Sonarr" if "series" in payload else None
+    instance = instances.get(f"{instance_type} {instance_name or ''}".strip())
+    if not instance or payload.get("eventType") == "Test":
+        return
+
+    # every event refetches just the item it is about, which keeps the library index current
+    if instance_type == "Radarr":
+        tmdb_id = payload["movie"]["tmdbId"]
+        movies = await instance.get_movie(id_=tmdb_id, tmdb=True)
+        movie = movies[0] if movies else None
+        if movie:
+            instance.library.update(movie)
+        else:
+            instance.library.discard(tmdb_id)
+
+        agent = await notification_agents.get(instance.name, tmdb_id)
+        if agent and movie_downloaded(movie):
+            await notify(agent)
+
+    else:
+        tvdb_id = payload["series"]["tvdbId"]
+        series = await instance.get_series(id_=tvdb_id, tvdb=True)
+        series = series[0] if series else None
+        if series:
+            instance.library.update(series)
+        else:
+            instance.library.discard(tvdb_id)
+
+        # a single episode import doesn't mean the season is complete
+        seasons = {episode["seasonNumber"] for episode in payload.get("episodes", [])}
+        for season in seasons:
+            agent = await notification_agents.get(instance.name, tvdb_id, season)
+            if agent and season_downloaded(series, season):
+                await notify(agent)
+
+async def check_movies(radarr: ArrClient, agents: list[NotificationAgent]):
+    schedule = notification_agents.schedule
+
+    # fetch the library and queue once and resolve every agent of the instance against them
+    movie_index = await get_movie_index(radarr)
+    radarr.title_index.update(movie_index.values(), "tmdbId")
+    radarr.library.replace(movie_index.values())
+    queued = await get_queued_movies(radarr, movie_index)
+    for agent in agents:
+        movie = movie_index.get(agent.media_id)
+        if movie_downloaded(movie):
+            await notify(agent)
+        elif agent.media_id in queued:
+            schedule.reset(agent.key)
+            progress.update(agent, queued[agent.media_id])
+        elif not movie_released(movie):
+            schedule.backoff(agent.key, UNRELEASED_POLL_INTERVAL)
+        else:
+            schedule.backoff(agent.key, POLL_MAX_INTERVAL)
+
+async def check_seasons(sonarr: ArrClient, agents: list[NotificationAgent]):
+    schedule = notification_agents.schedule
+
+    series_index = await get_series_index(sonarr)
+    sonarr.title_index.update(series_index.values(), "tvdbId")
+    sonarr.library.replace(series_index.values())
+    queued = await get_queued_seasons(sonarr, series_index)
+    for agent in agents:
+        series = series_index.get(agent.media_id)
+        if season_downloaded(series, agent.season):
+            await notify(agent)
+        elif (agent.media_id, agent.season) in queued:
+            schedule.reset(agent.key)
+            progress.update(agent, queued[(agent.media_id, agent.season)])
+        elif not season_released(series, agent.season):
+            schedule.backoff(agent.key, UNRELEASED_POLL_INTERVAL)
+        else:
+            schedule.backoff(agent.key, POLL_MAX_INTERVAL)
+
+async def acquire_poller_lease() -> bool:
+    """Only the process holding the lease polls when several processes share the database"""
+    if not notification_agents.shared:
+        return True
+
+    store = notification_agents.store
+    leader = await store.run(store.acquire_lease, "poller", LEASE_HOLDER, POLLER_LEASE_TTL)
+    if leader != notification_agents.tracking:
+        logging.info(f"{LEASE_HOLDER} {'took over' if leader else 'lost'} the download poller")
+        notification_agents.tracking = leader
+        if not leader:
+            notification_agents.clear()
+    return leader
 
 async def check_downloads():
+    schedule = notification_agents.schedule
+    schedule.min_interval = POLL_INTERVAL
+    notification_agents.max_retry_interval = POLL_MAX_INTERVAL
+    # the lease is renewed well before it expires
+    wake_interval = min(POLL_INTERVAL, POLLER_LEASE_TTL / 3) if notification_agents.shared else POLL_INTERVAL
+    loaded = False
+    while True:
+        if not await acquire_poller_lease():
+            loaded = False
+            await asyncio.sleep(wake_interval)
+            continue
+
+        # resume tracking requests made before the last restart, and those other processes took
+        if notification_agents.store and (not loaded or notification_agents.shared):
+            await notification_agents.load()
+            if not loaded:
+                logging.info(f"Loaded {len(notification_agents)} pending requests")
+            loaded = True
+
+        # wake up when the next agent is due, but at least every POLL_INTERVAL to pick up new requests
+        next_due = schedule.next_due()
+        await asyncio.sleep(wake_interval if next_due is None else min(next_due, wake_interval))
+
+        # the schedule only decides which instances to fetch, the library and queue cost the same
+        # however many agents they are checked against, so every agent of those instances is checked
+        due_instances = {agent.instance for key in schedule.pop_due() if (agent := notification_agents.agents.get(key))}
+        if not due_instances:
+            continue
+
+        agents_by_instance = defaultdict(list)
+        for key, agent in notification_agents.agents.items():
+            if agent.instance in due_instances and key not in notification_agents.delivering:
+                agents_by_instance[agent.instance].append(agent)
+
+        checked = sum(len(agents) for agents in agents_by_instance.values())
+        logging.info(f"Checking downloads | {checked}/{len(notification_agents)}")
+
+        # every instance is checked concurrently
+        await asyncio.gather(*(check_instance(name, agents) for name, agents in agents_by_instance.items()))
+
+async def check_instance(name: str, agents: list[NotificationAgent]):
+    instance = instances.get(name)
+    try:
+        if not instance:
+            raise Exception(f"{name} is no longer configured")
+
+        check = check_movies if instance.instance_type == "Radarr" else check_seasons
+        with metrics.poll_seconds.time(name):
+            await check(instance, agents)
+    except UNAVAILABLE_ERRORS as e:
+        logging.warning(f"Skipped checking {len(agents)} {name} downloads: {e}")
+        for agent in agents:
+            notification_agents.schedule.backoff(agent.key, POLL_MAX_INTERVAL)
+    except Exception:
+        logging.exception(f"Failed to check {name} downloads")
+        for agent in agents:
+            notification_agents.schedule.backoff(agent.key, POLL_MAX_INTERVAL)
+
+async def supervise(name: str, run: Callable[[], Awaitable[None]]):
+    """Keeps a background loop running, restarting it with a growing delay whenever it fails"""
+    delay = 1
+    while True:
+        started = time.monotonic()
+        try:
+            await run()
+            return
+        except Exception:
+            # a loop that ran for a while before failing starts over with a short delay
+            if time.monotonic() - started > SUPERVISOR_MAX_DELAY:
+                delay = 1
+            logging.exception(f"{name} stopped, restarting in {delay}s")
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, SUPERVISOR_MAX_DELAY)
+
+async def refresh_metadata():
     while True:
-        logging.info(f"Checking downloads | {len(notification_agents)}")
-        await asyncio.sleep(5)
-        for agent in notification_agents:
-            if agent.instance_type == "Radarr":
-                if check_movie_downloaded(agent.info):
-                    # send message to each channel. include all users in message for that given channel
-                    for channel_id, members in agent.notified_members.items():
-                        channel = client.get_channel(channel_id)
-                        members_to_mention = " ".join([member.mention for member in members])
-                        await channel.send(content=f"{members_to_mention} **{agent.info['title']}** has finished downloading!", embed=agent.embed)
-
-                    notification_agents.remove(agent)
-
-            elif agent.instance_type == "Sonarr":
-                if check_series_season_downloaded(agent.info, agent.season):
-                    # send message to each channel. include all users in message for that given channel
-                    for channel_id, members in agent.notified_members.items():
-                        channel = client.get_channel(channel_id)
-                        members_to_mention = " ".join([member.mention for member in members])
-                        await channel.send(content=f"{members_to_mention} **{agent.info['title']} Season {agent.season}** has finished downloading!", embed=agent.embed)
-
-                    notification_agents.remove(agent)
-
-def sync_commands(command_type: str, command: list, config: dict[str, str]):
-    global sonarr
-    global radarr
-
-    if command_type == "SONARR":
-        if not sonarr:
-            sonarr = SonarrAPI(config["url"], config["api_key"])
-    elif command_type == "RADARR":
-        if not radarr:
-            radarr = RadarrAPI(config["url"], config["api_key"])
+        unreachable = any(not instance.metadata_loaded for instance in instances.values())
+        await asyncio.sleep(METADATA_RETRY_INTERVAL if unreachable else METADATA_REFRESH_INTERVAL)
+        results = await asyncio.gather(*(instance.refresh_metadata() for instance in instances.values()), return_exceptions=True)
+        for instance, result in zip(instances.values(), results):
+            if isinstance(result, OUTAGE_ERRORS):
+                logging.warning(f"Failed to refresh quality profiles and root folders for {instance.name}: {result}")
+            elif isinstance(result, Exception):
+                logging.error(f"Failed to refresh quality profiles and root folders for {instance.name}", exc_info=result)
+            else:
+                validate_commands(instance)
+
+def validate_commands(instance: ArrClient):
+    """Logs the commands whose quality profile or root folder no longer exists, the bot keeps running"""
+    for command in configured_commands[instance.name]:
+        try:
+            instance.validate_command(command.qualityprofile, command.rootfolderpath)
+        except Exception as e:
+            logging.error(f"Invalid {instance.name} command \"{command.name}\": {e}")
+
+async def refresh_libraries():
+    """Rebuilds every instance's library index and title index from one library fetch each"""
+    while True:
+        for instance in instances.values():
+            try:
+                if instance.instance_type == "Radarr":
+                    items = await instance.get_movie()
+                    instance.title_index.update(items, "tmdbId")
+                else:
+                    items = await instance.get_series()
+                    instance.title_index.update(items, "tvdbId")
+                instance.library.replace(items)
+                logging.info(f"{instance.name} library | {len(instance.library)} items, {len(instance.title_index)} titles")
+            except UNAVAILABLE_ERRORS as e:
+                logging.warning(f"Keeping the last {instance.name} library snapshot: {e}")
+            except Exception:
+                logging.exception(f"Failed to refresh the {instance.name} library")
+
+        await asyncio.sleep(LIBRARY_REFRESH_INTERVAL)
+
+def arr_client_config() -> dict:
+    return {
+        "lookup_cache_size": int(os.environ.get("LOOKUP_CACHE_SIZE", 256)),
+        "lookup_cache_ttl": float(os.environ.get("LOOKUP_CACHE_TTL", 600)),
+        "lookup_cache_stale_ttl": float(os.environ.get("LOOKUP_CACHE_STALE_TTL", 86400)),
+        "rate_limit": float(os.environ.get("ARR_RATE_LIMIT", 10)),
+        "timeout": float(os.environ.get("ARR_TIMEOUT", 10)),
+        "failure_threshold": int(os.environ.get("ARR_FAILURE_THRESHOLD", 5)),
+        "retry_interval": float(os.environ.get("ARR_RETRY_INTERVAL", 30)),
+    }
+
+def sync_commands(instance: ArrClient, command: Command):
+    # fail at boot rather than on the first request click. an instance that is down is checked by refresh_metadata once it is back
+    if instance.metadata_loaded:
+        try:
+            instance.validate_command(command.qualityprofile, command.rootfolderpath)
+        except Exception as e:
+            raise Exception(f"Invalid {instance.name} command \"{command.name}\": {e}") from e
+    configured_commands[instance.name].append(command)
 
     async def command_func(interaction, title: str):
-        if command_type == "SONARR":
-            entries = get_series(title, sonarr)
-            view = SeriesSelectView(series_found=entries, quality_profile=command.qualityprofile, root_folder_path=command.rootfolderpath)
-        elif command_type == "RADARR":
-            entries = get_movie(title, radarr)
-            view = MovieSelectView(movies_found=entries, quality_profile=command.qualityprofile, root_folder_path=command.rootfolderpath)
+        # lookups can outlast the 3 second interaction deadline, so acknowledge first
+        await interaction.response.defer(thinking=True)
+
+        try:
+            if instance.instance_type == "Sonarr":
+                entries = await get_series(title, instance)
+                view = SeriesSelectView(series_found=entries, sonarr_instance=instance, quality_profile=command.qualityprofile, root_folder_path=command.rootfolderpath)
+            else:
+                entries = await get_movie(title, instance)
+                view = MovieSelectView(movies_found=entries, radarr_instance=instance, quality_profile=command.qualityprofile, root_folder_path=command.rootfolderpath)
+        except UNAVAILABLE_ERRORS as e:
+            logging.warning(f"Search for \"{title}\" failed: {e}")
+            await interaction.followup.send(unavailable_message(instance))
+            return
+        logging.debug(f"{instance.name} lookup cache | {instance.lookup_cache.stats()}")
 
         if entries:
-            await interaction.response.send_message(f"Select an item", view=view)
+            await interaction.followup.send(f"Select an item", view=view)
         else:
-            await interaction.response.send_message(f"No item found with the name \"{title}\". Please make sure you spelled it correctly.")
+            await interaction.followup.send(f"No item found with the name \"{title}\". Please make sure you spelled it correctly.")
+
+    async def title_autocomplete(interaction, current: str):
+        # answered from the local index, autocomplete never calls the Arr API
+        return [discord.app_commands.Choice(name=display[:100], value=title[:100]) for display, title in instance.title_index.search(current)]
 
+    command_func = metrics.timed_callback("search")(command_func)
     if guild_id:
-        tree.command(name=command.name, guild=discord.Object(id=guild_id))(command_func)
+        slash_command = tree.command(name=command.name, guild=discord.Object(id=guild_id))(command_func)
     else:
-        tree.command(name=command.name)(command_func)
-
-
-
-@client.event
-async def on_ready():
+        slash_command = tree.command(name=command.name)(command_func)
+    slash_command.autocomplete("title")(metrics.timed_callback("autocomplete")(title_autocomplete))
+
+    async def bulk_command_func(interaction, titles: Optional[str] = None, file: Optional[discord.Attachment] = None):
+        await interaction.response.defer(thinking=True)
+
+        # titles are separated by ";" in the option and by new lines in the file
+        text = titles or ""
+        if file:
+            text += "\n" + (await file.read()).decode("utf-8", errors="ignore")
+
+        terms = parse_titles(text)
+        if not terms:
+            await interaction.followup.send("Please provide at least one title, e.g. `Dune (2021); tmdb:603`, or attach a file with one title per line.")
+            return
+        if len(terms) > BULK_MAX_TITLES:
+            await interaction.followup.send(f"You can request at most {BULK_MAX_TITLES} titles at once.")
+            return
+
+        summary = await bulk_request(terms, instance, command.qualityprofile, command.rootfolderpath, interaction, BULK_CONCURRENCY)
+        await interaction.followup.send(summary)
+
+    bulk_command_func = metrics.timed_callback("bulk")(bulk_command_func)
+    bulk_name = f"{command.name}-bulk"[:32]
     if guild_id:
-        await tree.sync(guild=discord.Object(id=guild_id))
+        tree.command(name=bulk_name, description="Request several titles at once", guild=discord.Object(id=guild_id))(bulk_command_func)
     else:
-        await tree.sync()
+        tree.command(name=bulk_name, description="Request several titles at once")(bulk_command_func)
 
-    # create new task to check downloads
-    asyncio.create_task(check_downloads())
 
-    logging.info("Seekarr is online!")
 
-    # print all commands
-    if not guild_id:
-        commands = await tree.fetch_commands()
+async def sync_tree():
+    """Syncs the commands with Discord only if they changed since the last sync, syncing is heavily rate limited"""
+    guild = discord.Object(id=guild_id) if guild_id else None
+    commands = tree.get_commands(guild=guild)
+    payload = [command.to_dict(tree) for command in commands]
+    command_hash = hashlib.sha256(json.dumps([client.application_id, guild_id, payload], sort_keys=True, default=str).encode()).hexdigest()
+
+    store = notification_agents.store
+    setting = f"command_hash:{guild_id or 'global'}"
+    if store and not FORCE_COMMAND_SYNC and await store.run(store.get_setting, setting) == command_hash:
+        logging.info(f"{len(commands)} commands unchanged since the last sync")
     else:
-        commands = await tree.fetch_commands(guild=discord.Object(id=guild_id))
+        await tree.sync(guild=guild)
+        if store:
+            await store.run(store.set_setting, setting, command_hash)
+        logging.info(f"Synced {len(commands)} commands")
 
     for command in commands:
         logging.info(f"Added command: {command.name}")
 
+@client.event
+async def setup_hook():
+    # setup_hook only runs once, unlike on_ready which fires again on every reconnect,
+    # so the commands are synced and the background loops started exactly once
+    await sync_tree()
+
+    asyncio.create_task(supervise("Download checks", check_downloads))
+    asyncio.create_task(supervise("Metadata refresh", refresh_metadata))
+    asyncio.create_task(supervise("Library refresh", refresh_libraries))
+
+    if WEBHOOK_PORT:
+        await start_webhook_server(handle_webhook, os.environ.get("WEBHOOK_HOST", "0.0.0.0"), int(WEBHOOK_PORT), os.environ.get("WEBHOOK_TOKEN"))
+    if METRICS_PORT:
+        await metrics.start_metrics_server(os.environ.get("METRICS_HOST", "127.0.0.1"), int(METRICS_PORT))
+        asyncio.create_task(metrics.monitor_event_loop())
+
+@client.event
+async def on_ready():
+    logging.info("Seekarr is online!")
+
+
+def create_instances(command_type: str):
+    """Creates a client for {command_type}_URL and every named {command_type}_<NAME>_URL"""
+    api_class = SonarrAPI if command_type == "SONARR" else RadarrAPI
+    url_envs = sorted(env for env in os.environ if re.fullmatch(f"{command_type}(_\\w+)?_URL", env))
+    for url_env in url_envs:
+        prefix = url_env.removesuffix("_URL")
+        instance_name = f"{command_type.title()} {prefix.removeprefix(command_type).lstrip('_')}".strip()
+        instances[instance_name] = ArrClient(api_class(os.environ[url_env], os.environ[f"{prefix}_API_KEY"]), name=instance_name, instance_type=command_type.title(), **arr_client_config())
+
+def load_metadata():
+    """Fetches every instance's quality profiles and root folders at the same time"""
+    def load(instance: ArrClient):
+        try:
+            instance.load_metadata()
+        except OUTAGE_ERRORS as e:
+            # Radarr/Sonarr often start after Seekarr, so an instance that is down doesn't stop the bot
+            logging.warning(f"{instance.name} is unreachable, its commands are checked once it is back: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(len(instances), 1)) as executor:
+        # list() re-raises any other error, e.g. a wrong API key
+        list(executor.map(load, instances.values()))
 
 def add_commands(command_type: str):
-    command_envs = [env for env in os.environ if env.startswith(f"{command_type}_")]
-    if command_envs:
-        command_url = os.environ[f"{command_type}_URL"]
-        command_api_key = os.environ[f"{command_type}_API_KEY"]
+    """Adds the commands of every {command_type} instance"""
+    for instance in [instance for instance in instances.values() if instance.instance_type == command_type.title()]:
+        prefix = instance.name.upper().replace(" ", "_")
 
-        # get any command prefixed with {command_type}_COMMAND_
-        commands = [command for command in command_envs if command.startswith(f"{command_type}_COMMAND_")]
+        # get any command prefixed with {prefix}_COMMAND_
+        commands = [env for env in os.environ if env.startswith(f"{prefix}_COMMAND_")]
         if len(commands) > 0:
             for command in commands:
                 fields = os.environ[command].split(",")
                 command = Command(name=fields[0], rootfolderpath=fields[1], qualityprofile=fields[2])
-                sync_commands(command_type, command, {"url": command_url, "api_key": command_api_key})
+                sync_commands(instance, command)
         else:
-            raise Exception(f"No {command_type} commands found. Please set at least one {command_type} command.\nExample: {command_type}_COMMAND_TV request-media,/media,Any")
+            raise Exception(f"No {instance.name} commands found. Please set at least one {instance.name} command.\nExample: {prefix}_COMMAND_TV request-media,/media,Any")
 
 def add_base_commands():
     """Adds ping and version commands"""
@@ -150,6 +497,16 @@ if __name__ == "__main__":
     if os.environ.get("GUILD_ID"):
         guild_id = int(os.environ["GUILD_ID"])
 
+    notification_agents.store = AgentStore(os.environ.get("DATABASE_PATH", "seekarr.db"))
+    if SHARED_DATABASE:
+        notification_agents.shared = True
+        # until this process takes the poller lease, requests are only written to the database
+        notification_agents.tracking = False
+
+    create_instances("SONARR")
+    create_instances("RADARR")
+    load_metadata()
+
     add_base_commands()
     add_commands("SONARR")
     add_commands("RADARR")
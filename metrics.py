@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import discord
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 3, 5, 10, 30)
+
+registry: list["Metric"] = []
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple, bound: Optional[str] = None) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if bound:
+        pairs.append(f'le="{bound}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A metric family in the Prometheus text format.
+
+    `collect` can return {label values: value} to read the value when scraped instead of keeping it up to date.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), collect: Optional[Callable[[], dict[tuple, float]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+        self.values: dict[tuple, float] = {}
+        registry.append(self)
+
+    def samples(self) -> list[str]:
+        values = self.collect() if self.collect else self.values
+        return [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in values.items()]
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self.samples()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.series: dict[tuple, list] = {} # label values -> [count per bucket, sum, count]
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (bucket_counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, str(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, '+Inf')} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+arr_request_seconds = Histogram("seekarr_arr_request_seconds", "Time spent on Radarr/Sonarr API calls, including waiting for the rate limiter", ("instance", "endpoint"))
+arr_request_errors = Counter("seekarr_arr_request_errors_total", "Radarr/Sonarr API calls that raised", ("instance", "endpoint"))
+interaction_seconds = Histogram("seekarr_interaction_seconds", "Time from an interaction being created to its callback returning", ("callback",))
+# Discord fails interactions that aren't acknowledged within 3 seconds, however long the callback runs after
+interaction_ack_seconds = Histogram("seekarr_interaction_ack_seconds", "Time from an interaction being created to it being responded to or deferred", ("callback",))
+interaction_unacknowledged = Counter("seekarr_interaction_unacknowledged_total", "Callbacks that returned without responding to their interaction", ("callback",))
+poll_seconds = Histogram("seekarr_poll_seconds", "Time spent checking the due requests of an instance", ("instance",))
+notification_send_seconds = Histogram("seekarr_notification_send_seconds", "Time spent sending a notification message, including retries")
+event_loop_lag_seconds = Gauge("seekarr_event_loop_lag_seconds", "How late the event loop last woke up a sleeping task")
+
+
+def interaction_age(interaction: discord.Interaction) -> float:
+    return (discord.utils.utcnow() - interaction.created_at).total_seconds()
+
+
+async def watch_acknowledgement(interaction: discord.Interaction, name: str, interval: float = 0.05):
+    # discord.py has no hook for the response being sent, so is_done is checked until it flips
+    while not interaction.response.is_done():
+        await asyncio.sleep(interval)
+    interaction_ack_seconds.observe(interaction_age(interaction), name)
+
+
+def timed_callback(name: str):
+    """Records how long after the interaction was created it was acknowledged, and the decorated callback finished"""
+    def decorator(callback):
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            interaction = next((arg for arg in args if isinstance(arg, discord.Interaction)), None)
+            if not interaction:
+                return await callback(*args, **kwargs)
+
+            watcher = asyncio.create_task(watch_acknowledgement(interaction, name))
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                if not watcher.done():
+                    watcher.cancel()
+                    if interaction.response.is_done():
+                        # acknowledged since the watcher last looked
+                        interaction_ack_seconds.observe(interaction_age(interaction), name)
+                    else:
+                        interaction_unacknowledged.inc(name)
+                interaction_seconds.observe(interaction_age(interaction), name)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+async def monitor_event_loop(interval: float = 1):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.set(max(0, loop.time() - start - interval))
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serves GET /metrics in the Prometheus text format"""
+
+    async def scrape(request: web.Request) -> web.Response:
+        return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", scrape)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics on {host}:{port}")
+    return runner
@@ -1,22 +1,211 @@
+import json
+from collections import Counter
 from dataclasses import dataclass, field
 from typing import Optional
 
 import discord
 
+from scheduler import PollScheduler
 
-@dataclass
+
+def pack_embed(embed: Optional[discord.Embed]) -> Optional[str]:
+    return json.dumps(embed.to_dict(), separators=(",", ":")) if embed else None
+
+
+@dataclass(slots=True)
 class NotificationAgent:
+    """A pending request, kept to the ids needed to check on it and notify the requesters"""
     instance_type: str # Sonarr or Radarr
-    notified_members: dict[str, list[discord.Member]] = field(default_factory=dict)
-    embed: discord.Embed = None
-    info: dict = None
+    media_id: int # tmdbId or tvdbId
+    title: str
     season: Optional[int] = None
+    instance: Optional[str] = None # name of the Arr instance, e.g. "Radarr 4K"
+    notified_members: dict[int, set[int]] = field(default_factory=dict) # channel id -> member ids
+    embed: Optional[str] = None # serialized embed, only rebuilt when the notification is sent
+    messages: dict[int, int] = field(default_factory=dict) # request message id -> channel id, edited with the download progress
+
+    def __post_init__(self):
+        if not self.instance:
+            self.instance = self.instance_type
+
+    @property
+    def display_title(self) -> str:
+        return self.title if self.season is None else f"{self.title} Season {self.season}"
+
+    def build_embed(self) -> Optional[discord.Embed]:
+        return discord.Embed.from_dict(json.loads(self.embed)) if self.embed else None
+
+    @property
+    def key(self) -> tuple[str, int, Optional[int]]:
+        return (self.instance, self.media_id, self.season)
+
+    def add_member(self, member: discord.abc.Snowflake, channel_id: int) -> bool:
+        """Returns False if the member was already being notified in that channel"""
+        members = self.notified_members.setdefault(channel_id, set())
+        if member.id in members:
+            return False
+
+        members.add(member.id)
+        return True
+
+    def add_message(self, message_id: int, channel_id: int) -> bool:
+        if message_id in self.messages:
+            return False
+
+        self.messages[message_id] = channel_id
+        return True
+
+
+class NotificationRegistry:
+    """Pending notification agents indexed by (instance, tmdbId/tvdbId, season)
+
+    When `shared`, other processes write agents to the same store. Only the process holding the poller lease
+    keeps agents in memory (`tracking`), the others read and write through the store.
+
+    Announcing an agent claims it first, so it is only announced once, and it is only deleted once every
+    notification was sent. Channels that couldn't be notified are announced again on a later check.
+    """
+
+    def __init__(self):
+        self.agents: dict[tuple[str, int, Optional[int]], NotificationAgent] = {}
+        self.counts: Counter[str] = Counter()
+        self.schedule = PollScheduler()
+        # set by main when persistence is configured
+        self.store = None
+        self.shared = False
+        self.tracking = True
+        # agent key -> channels whose notification hasn't been sent yet
+        self.delivering: dict[tuple[str, int, Optional[int]], set[int]] = {}
+        # a claim older than this belongs to a process that stopped while announcing
+        self.claim_ttl = 300
+        # the longest wait before a failed notification is retried, set by main
+        self.max_retry_interval = 1800
+        # journal position of the last load, None until every agent has been loaded once
+        self.position: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.agents)
+
+    async def get(self, instance: str, media_id: int, season: Optional[int] = None) -> Optional[NotificationAgent]:
+        agent = self.agents.get((instance, media_id, season))
+        if not agent and self.shared:
+            # another process may have added it since the last load
+            agent = await self.store.run(self.store.get, (instance, media_id, season))
+        return agent
+
+    def track(self, agent: NotificationAgent):
+        if agent.key not in self.agents:
+            self.counts[agent.instance] += 1
+            self.schedule.add(agent.key)
+        self.agents[agent.key] = agent
+
+    def untrack(self, agent_key: tuple) -> bool:
+        agent = self.agents.pop(agent_key, None)
+        if agent:
+            self.counts[agent.instance] -= 1
+        self.schedule.discard(agent_key)
+        return agent is not None
+
+    async def add(self, agent: NotificationAgent):
+        await self.add_many([agent])
+
+    async def add_many(self, agents: list[NotificationAgent]):
+        if self.tracking:
+            for agent in agents:
+                self.track(agent)
+        if self.store and agents:
+            await self.store.run(self.store.save_many, self.store.agent_rows(agents))
+
+    async def add_member(self, agent: NotificationAgent, member: discord.abc.Snowflake, channel_id: int, message_id: Optional[int] = None):
+        if agent.add_member(member, channel_id) and self.store:
+            await self.store.run(self.store.add_member, agent, member.id, channel_id)
+        if message_id and agent.add_message(message_id, channel_id) and self.store:
+            await self.store.run(self.store.add_message, agent, message_id, channel_id)
+
+    async def claim(self, agent: NotificationAgent) -> bool:
+        """Starts announcing the agent. Returns False if this or another process is already announcing it,
+        or already did"""
+        if agent.key in self.delivering:
+            return False
+        if not self.store and agent.key not in self.agents:
+            return False
+
+        # taken before waiting on the store, so a second caller in this process backs off straight away
+        self.delivering[agent.key] = set()
+        if self.store:
+            stored = await self.store.run(self.store.claim, agent.key, self.claim_ttl)
+            if not stored:
+                del self.delivering[agent.key]
+                # checked again later in case the process announcing it stops before it is done
+                if agent.key in self.agents:
+                    self.schedule.backoff(agent.key, self.claim_ttl)
+                return False
+
+            # members other processes added since it was loaded
+            for channel_id, members in stored.notified_members.items():
+                agent.notified_members.setdefault(channel_id, set()).update(members)
+
+        self.delivering[agent.key].update(agent.notified_members)
+        if not agent.notified_members:
+            await self.finish(agent)
+        return True
+
+    async def delivered(self, agent: NotificationAgent, channel_id: int, member_ids: set[int], sent: bool):
+        """Records whether the members of a channel were notified, and finishes the agent once every channel was tried"""
+        if sent:
+            members = agent.notified_members.get(channel_id, set())
+            members -= member_ids
+            if not members:
+                agent.notified_members.pop(channel_id, None)
+            if self.store:
+                await self.store.run(self.store.delivered, agent, channel_id, member_ids)
+
+        channels = self.delivering[agent.key]
+        channels.discard(channel_id)
+        if not channels:
+            await self.finish(agent)
+
+    async def finish(self, agent: NotificationAgent):
+        """Deletes the agent if everyone was notified, otherwise schedules it to be announced again"""
+        if self.store:
+            # members may have been added while it was announced
+            pending = await self.store.run(self.store.release, agent) and await self.store.run(self.store.get, agent.key)
+        else:
+            pending = agent if agent.notified_members else None
+        del self.delivering[agent.key]
+
+        if not pending:
+            self.untrack(agent.key)
+        elif self.tracking:
+            self.track(pending)
+            self.schedule.backoff(pending.key, self.max_retry_interval)
+
+    async def load(self):
+        """Loads the stored agents, including the ones other processes added, changed or removed since the last load.
+        After the first load only the agents changed since are read"""
+        changes = await self.store.run(self.store.changes, self.position) if self.position is not None else None
+        if changes is None:
+            self.position, stored = await self.store.run(self.store.load)
+            changes = {agent.key: agent for agent in stored}
+            changes.update((key, None) for key in self.agents if key not in changes)
+        else:
+            self.position, changes = changes
+
+        for key, agent in changes.items():
+            # the agents being announced are put back by finish
+            if key in self.delivering:
+                continue
+            if agent:
+                self.track(agent)
+            else:
+                self.untrack(key)
 
-    def add_member(self, member: discord.Member, channel_id: int):
-        if channel_id not in self.notified_members:
-            self.notified_members[channel_id] = []
+    def clear(self):
+        """Forgets every agent kept in memory, they are still in the store"""
+        for key in list(self.agents):
+            self.untrack(key)
+        # the next load reads every agent again
+        self.position = None
 
-        self.notified_members[channel_id].append(member)
-        
 
-notification_agents: list[NotificationAgent] = []
\ No newline at end of file
+notification_agents = NotificationRegistry()
@@ -0,0 +1,124 @@
+import asyncio
+import datetime
+import logging
+from dataclasses import dataclass
+from typing import Hashable, Iterable, Optional
+
+import discord
+
+from dispatcher import MAX_CONTENT_LENGTH
+from notifications import NotificationAgent
+
+IMPORTING_STATES = {"importPending", "importing"}
+
+
+@dataclass(slots=True)
+class DownloadProgress:
+    size: float = 0
+    sizeleft: float = 0
+    status: str = "queued"
+    eta: Optional[datetime.datetime] = None
+
+    @property
+    def percent(self) -> float:
+        return 100 * (self.size - self.sizeleft) / self.size if self.size else 0
+
+    def add(self, record: dict):
+        """Adds one queue record, e.g. one of several episodes downloading for the same season"""
+        self.size += record.get("size") or 0
+        self.sizeleft += record.get("sizeleft") or 0
+        if record.get("trackedDownloadState") in IMPORTING_STATES:
+            self.status = "importing"
+        elif self.status != "downloading":
+            self.status = record.get("status") or self.status
+
+        if record.get("estimatedCompletionTime"):
+            eta = datetime.datetime.fromisoformat(record["estimatedCompletionTime"].replace("Z", "+00:00"))
+            self.eta = max(self.eta, eta) if self.eta else eta
+
+    def render(self) -> str:
+        text = f"{self.status.capitalize()} | {self.percent:.0f}%"
+        if self.eta and self.status == "downloading":
+            # a relative timestamp is rendered by the client, so the text only changes when the ETA does
+            text += f" | done <t:{int(self.eta.timestamp()) // 60 * 60}:R>"
+        return text
+
+
+def queue_progress(records: Iterable[dict], keys: Iterable[Optional[Hashable]]) -> dict[Hashable, DownloadProgress]:
+    """Sums the queue records for each key, e.g. a tmdbId or a (tvdbId, season) pair"""
+    progress = {}
+    seen_downloads = set()
+    for record, key in zip(records, keys):
+        if key is None:
+            continue
+
+        # a season pack shows up once per episode, each with the size of the whole download
+        download = (key, record.get("downloadId") or record.get("id"))
+        if download in seen_downloads:
+            continue
+        seen_downloads.add(download)
+
+        progress.setdefault(key, DownloadProgress()).add(record)
+    return progress
+
+
+class ProgressTracker:
+    """Keeps the messages requests were made from updated with the download progress.
+
+    A message shows one line per request made from it (e.g. each requested season). Updates only queue
+    an edit when a line changed, and queued edits are flushed at most once every `interval` seconds, so
+    each message is edited at most once per interval however often the queue is polled.
+    """
+
+    def __init__(self, client: discord.Client, interval: float = 30):
+        self.client = client
+        self.interval = interval
+        self.lines: dict[int, dict[tuple, str]] = {} # message id -> agent key -> progress line
+        self.pending: dict[int, int] = {} # message id -> channel id of messages with changed lines
+        self.unreachable: set[int] = set()
+        self.flusher: Optional[asyncio.Task] = None
+
+    def update(self, agent: NotificationAgent, progress: DownloadProgress):
+        if self.interval <= 0:
+            return
+
+        line = f"**{agent.display_title}** | {progress.render()}"
+        for message_id, channel_id in agent.messages.items():
+            lines = self.lines.setdefault(message_id, {})
+            if message_id not in self.unreachable and lines.get(agent.key) != line:
+                lines[agent.key] = line
+                self.pending[message_id] = channel_id
+
+        if self.pending and not self.flusher:
+            self.flusher = asyncio.create_task(self.flush())
+
+    def discard(self, agent: NotificationAgent):
+        for message_id in agent.messages:
+            lines = self.lines.get(message_id, {})
+            lines.pop(agent.key, None)
+            if not lines:
+                self.lines.pop(message_id, None)
+                self.pending.pop(message_id, None)
+
+    async def flush(self):
+        try:
+            while self.pending:
+                edits = self.pending
+                self.pending = {}
+                for message_id, channel_id in edits.items():
+                    if self.lines.get(message_id):
+                        await self.edit(channel_id, message_id, "\n".join(self.lines[message_id].values())[:MAX_CONTENT_LENGTH])
+                await asyncio.sleep(self.interval)
+        finally:
+            self.flusher = None
+
+    async def edit(self, channel_id: int, message_id: int, content: str):
+        try:
+            channel = self.client.get_channel(channel_id) or await self.client.fetch_channel(channel_id)
+            await channel.get_partial_message(message_id).edit(content=content)
+        except (discord.NotFound, discord.Forbidden):
+            # deleted or no longer visible, stop trying to update it
+            self.unreachable.add(message_id)
+            self.lines.pop(message_id, None)
+        except Exception:
+            logging.exception(f"Failed to update the progress of message {message_id}")
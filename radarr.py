@@ -1,57 +1,242 @@
-import discord
-from pyarr import RadarrAPI
+import copy
 import datetime
+from typing import Optional
+
+import discord
+from pyarr.exceptions import PyarrBadRequest
+
+import metrics
+from arr import UNAVAILABLE_ERRORS, ArrClient, missing_profile_message, unavailable_message
+from cache import normalize_term
+from notifications import NotificationAgent, notification_agents, pack_embed
+from progress import DownloadProgress, queue_progress
+
+QUEUE_PAGE_SIZE = 1000
+
+async def get_movie(title: str, radarr_instance: ArrClient):
+    async def lookup():
+        movies = await radarr_instance.lookup_movie(term=title)
+        radarr_instance.title_index.update(movies, "tmdbId")
+        return movies[:25]
+
+    movies = await radarr_instance.lookup_cache.get(normalize_term(title), lookup)
+    # requesting mutates the lookup dicts, so every caller gets its own copy
+    return copy.deepcopy(movies)
 
-from notifications import NotificationAgent, notification_agents
+async def get_movie_index(radarr_instance: ArrClient) -> dict[int, dict]:
+    """Fetches the whole Radarr library in a single call and indexes it by tmdbId"""
+    return {movie["tmdbId"]: movie for movie in await radarr_instance.get_movie()}
 
-radarr = None
+def movie_downloaded(movie: dict) -> bool:
+    return bool(movie and movie["hasFile"])
 
-def get_movie(title: str, radarr_instance: RadarrAPI):
-    global radarr
-    radarr = radarr_instance
-    movies = radarr.lookup_movie(term=title)
-    return movies[:25]
+def movie_released(movie: dict) -> bool:
+    return not movie or movie.get("isAvailable", True)
 
-def check_movie_downloaded(movie_info: dict) -> bool:
-    movie = radarr.get_movie(id_=movie_info["tmdbId"], tmdb=True)
+async def get_queued_movies(radarr_instance: ArrClient, movie_index: dict[int, dict]) -> dict[int, DownloadProgress]:
+    """Returns the download progress of every movie in the queue, keyed by tmdbId"""
+    queue = await radarr_instance.get_queue(page_size=QUEUE_PAGE_SIZE)
+    tmdb_ids = {movie["id"]: tmdb_id for tmdb_id, movie in movie_index.items()}
+    return queue_progress(queue["records"], (tmdb_ids.get(record.get("movieId")) for record in queue["records"]))
+
+async def check_movie_downloaded(movie_info: dict, radarr_instance: ArrClient) -> bool:
+    # answer from the library index once it has been loaded, it is kept current in the background
+    if radarr_instance.library.loaded:
+        status = radarr_instance.library.get(movie_info["tmdbId"])
+        return bool(status and status.has_file)
+
+    movie = await radarr_instance.get_movie(id_=movie_info["tmdbId"], tmdb=True)
     if len(movie) > 0:
-        if movie[0]["hasFile"]:
-            return True
+        radarr_instance.library.update(movie[0])
+        return movie_downloaded(movie[0])
 
     return False
 
+def apply_library_status(movie: dict, radarr_instance: ArrClient):
+    """Sets whether the movie is in Radarr from the library index, a cached lookup result can predate a request.
+    check_movie_downloaded has to run first, it puts the movie in the index if the index isn't loaded yet"""
+    status = radarr_instance.library.get(movie["tmdbId"])
+    movie["monitored"] = bool(status and status.monitored)
+    if status and status.id:
+        movie["id"] = status.id
+    else:
+        movie.pop("id", None)
+
+async def monitor_movie(radarr_instance: ArrClient, tmdb_id: int) -> Optional[dict]:
+    """Monitors and searches for a movie that is already in Radarr, returns None if it isn't in Radarr"""
+    movies = await radarr_instance.get_movie(id_=tmdb_id, tmdb=True)
+    if not movies:
+        return None
+
+    movie = movies[0]
+    if not movie["monitored"]:
+        movie["monitored"] = True
+        movie = await radarr_instance.upd_movie(movie)
+        await radarr_instance.post_command("MoviesSearch", movieIds=[movie["id"]])
+    return movie
+
+async def create_notification_agent(movie: dict, embed: discord.Embed, interaction: discord.Interaction, radarr_instance: ArrClient):
+    # the message the request was made from is kept updated with the download progress
+    message_id = interaction.message.id if interaction.message else None
+    existing_agent = await notification_agents.get(radarr_instance.name, movie["tmdbId"])
+    if not existing_agent:
+        agent = NotificationAgent(instance_type="Radarr", media_id=movie["tmdbId"], title=movie["title"], instance=radarr_instance.name, embed=pack_embed(embed))
+        agent.add_member(interaction.user, interaction.channel_id)
+        if message_id:
+            agent.add_message(message_id, interaction.channel_id)
+        await notification_agents.add(agent)
+    else:
+        await notification_agents.add_member(existing_agent, interaction.user, interaction.channel_id, message_id)
+
+async def bulk_request_movies(movies: list[dict], radarr_instance: ArrClient, quality_profile_id: int, root_folder_path: str, interaction: discord.Interaction) -> dict[str, list[str]]:
+    """Requests every movie that isn't in Radarr yet with a single import call and tracks all of them"""
+    summary = {"Requested": [], "Already requested": [], "Already available": []}
+    new_movies = []
+    for movie in movies:
+        if await check_movie_downloaded(movie, radarr_instance):
+            summary["Already available"].append(movie["title"])
+            continue
+
+        apply_library_status(movie, radarr_instance)
+        if movie.get("id") and movie["monitored"]:
+            await create_notification_agent(movie, build_movie_embed(movie), interaction, radarr_instance)
+            summary["Already requested"].append(movie["title"])
+        elif movie.get("id") and (monitored_movie := await monitor_movie(radarr_instance, movie["tmdbId"])):
+            # it was in Radarr, but nothing was looking for it
+            radarr_instance.record_change(monitored_movie)
+            await create_notification_agent(movie, build_movie_embed(movie), interaction, radarr_instance)
+            summary["Requested"].append(movie["title"])
+        else:
+            movie.pop("id", None)
+            new_movies.append(movie)
+
+    if new_movies:
+        for movie in new_movies:
+            # same fields RadarrAPI.add_movie fills in, sent as one batch
+            movie["rootFolderPath"] = root_folder_path
+            movie["qualityProfileId"] = quality_profile_id
+            movie["monitored"] = True
+            movie["minimumAvailability"] = "announced"
+            movie["addOptions"] = {"monitor": "movieOnly", "searchForMovie": True}
+            movie["tags"] = []
+
+        for added_movie in await radarr_instance.import_movies(new_movies):
+            radarr_instance.record_change(added_movie)
+
+        for movie in new_movies:
+            await create_notification_agent(movie, build_movie_embed(movie), interaction, radarr_instance)
+            summary["Requested"].append(movie["title"])
+
+    return summary
+
+def build_movie_embed(movie: dict) -> discord.Embed:
+    description = ""
+    if movie.get("overview"):
+        if len(movie["overview"]) > 255:
+            description = movie["overview"][:255] + "(...)"
+        else:
+            description = movie["overview"]
+
+
+    embed = discord.Embed(
+        title=f"{movie['title']}",
+        url=f"https://www.themoviedb.org/movie/{movie['tmdbId']}",
+        description=description,
+        color=0x3498db
+    )
+
+    embed.set_thumbnail(url="https://upload.wikimedia.org/wikipedia/commons/thumb/8/89/Tmdb.new.logo.svg/2560px-Tmdb.new.logo.svg.png")
+    embed.set_footer(text=f"Powered by Seekarr")
+
+
+    row_count = 0
+    if movie.get("inCinemas"):
+        converted_date = datetime.datetime.strptime(movie["inCinemas"], "%Y-%m-%dT%H:%M:%SZ")
+        embed.add_field(name="__In Theaters:__", value=f"{converted_date.strftime('%B %d, %Y')}", inline=True)
+        row_count += 1
+    if movie.get("physicalRelease"):
+        converted_date = datetime.datetime.strptime(movie["physicalRelease"], "%Y-%m-%dT%H:%M:%SZ")
+        embed.add_field(name="__Physical Release:__", value=f"{converted_date.strftime('%B %d, %Y')}", inline=True)
+        row_count += 1
+    if movie.get("digitalRelease"):
+        converted_date = datetime.datetime.strptime(movie["digitalRelease"], "%Y-%m-%dT%H:%M:%SZ")
+        embed.add_field(name="__Digital Release:__", value=f"{converted_date.strftime('%B %d, %Y')}", inline=True)
+        row_count += 1
+
+    for _ in range(3 - row_count):
+        # fills the end of the row with empty fields
+        embed.add_field(name="\u200b", value="\u200b", inline=True)
+
+    # add ratings
+    row_count = 0
+    if movie.get("ratings"):
+        if movie["ratings"].get("rottenTomatoes"):
+            embed.add_field(name="<:rottentomatoes:1198430940054159491>", value=f"{movie['ratings']['rottenTomatoes']['value']}%", inline=True)
+            row_count += 1
+        if movie["ratings"].get("imdb"):
+            embed.add_field(name="<:imdb:1198433037172617346>", value=f"{movie['ratings']['imdb']['value']:.2f}/10", inline=True)
+            row_count += 1
+        if movie["ratings"].get("tmdb"):
+            embed.add_field(name="<:tmdb:1198437511970684978>", value=f"{movie['ratings']['tmdb']['value']:.2f}/10", inline=True)
+            row_count += 1
+
+    if row_count != 0:
+        for _ in range(3 - row_count):
+            embed.add_field(name="\u200b", value="\u200b", inline=True)
+
+
+    if movie.get("remotePoster"):
+        embed.set_image(url=movie["remotePoster"])
+
+    return embed
+
 class RequestButton(discord.ui.Button):
-    def __init__(self, movie, quality_profile, root_folder_path, embed):
+    def __init__(self, movie, radarr_instance, quality_profile, root_folder_path, embed):
         self.movie = movie
+        self.radarr = radarr_instance
         self.quality_profile = quality_profile
         self.root_folder_path = root_folder_path
         self.embed = embed
         super().__init__(label='Request', style=discord.ButtonStyle.primary)
 
+    @metrics.timed_callback("radarr_request")
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer()
 
-        # get quality profiles
-        quality_profiles = radarr.get_quality_profile()
-        quality_profile_id = int(next(profile["id"] for profile in quality_profiles if profile["name"] == self.quality_profile))
+        # quality profiles are resolved at startup and refreshed in the background, a refresh can drop one
+        quality_profile_id = self.radarr.quality_profiles.get(self.quality_profile)
+        if quality_profile_id is None:
+            await interaction.message.edit(content=missing_profile_message(self.radarr, self.quality_profile), view=self.view)
+            return
 
-        radarr.add_movie(self.movie, quality_profile_id=quality_profile_id, root_dir=self.root_folder_path, search_for_movie=True)
+        try:
+            # a movie that is in Radarr but unmonitored only has to be monitored
+            added_movie = await monitor_movie(self.radarr, self.movie["tmdbId"]) if self.movie.get("id") else None
+            if not added_movie:
+                try:
+                    added_movie = await self.radarr.add_movie(self.movie, quality_profile_id=quality_profile_id, root_dir=self.root_folder_path, search_for_movie=True)
+                except PyarrBadRequest:
+                    # someone else added it since it was selected
+                    added_movie = await monitor_movie(self.radarr, self.movie["tmdbId"])
+                    if not added_movie:
+                        raise
+        except UNAVAILABLE_ERRORS:
+            await interaction.message.edit(content=unavailable_message(self.radarr), view=self.view)
+            return
+        self.radarr.record_change(added_movie)
 
         self.label = "Requested"
         self.disabled = True
 
-        agent = NotificationAgent(instance_type="Radarr")
-        agent.info = self.movie
-        agent.add_member(interaction.user, interaction.channel_id)
-        agent.embed = self.embed
-        notification_agents.append(agent)
+        await create_notification_agent(self.movie, self.embed, interaction, self.radarr)
 
         await interaction.message.edit(content=f"Successfully requested **{self.movie['title']}**!", view=self.view)
 
 
 class SelectMenu(discord.ui.Select):
-    def __init__(self, movies, quality_profile, root_folder_path):
+    def __init__(self, movies, radarr_instance, quality_profile, root_folder_path):
         self.movies = movies
+        self.radarr = radarr_instance
         self.quality_profile = quality_profile
         self.root_folder_path = root_folder_path
         options = []
@@ -60,95 +245,44 @@ class SelectMenu(discord.ui.Select):
 
         super().__init__(placeholder="Select a movie", min_values=1, max_values=1, options=options)
 
+    @metrics.timed_callback("radarr_select")
     async def callback(self, interaction: discord.Interaction):
         selected_movie = int(self.values[0])
         selected_movie_info = self.movies[selected_movie]
         self.placeholder = selected_movie_info["title"]
 
-        description = ""
-        if selected_movie_info.get("overview"):
-            if len(selected_movie_info["overview"]) > 255:
-                description = selected_movie_info["overview"][:255] + "(...)"
-            else:
-                description = selected_movie_info["overview"]
-
-
-        embed = discord.Embed(
-            title=f"{selected_movie_info['title']}",
-            url=f"https://www.themoviedb.org/movie/{selected_movie_info['tmdbId']}",
-            description=description,
-            color=0x3498db
-        )
-
-        embed.set_thumbnail(url="https://upload.wikimedia.org/wikipedia/commons/thumb/8/89/Tmdb.new.logo.svg/2560px-Tmdb.new.logo.svg.png")
-        embed.set_footer(text=f"Powered by Seekarr")
+        embed = build_movie_embed(selected_movie_info)
 
-
-        row_count = 0
-        if selected_movie_info.get("inCinemas"):
-            converted_date = datetime.datetime.strptime(selected_movie_info["inCinemas"], "%Y-%m-%dT%H:%M:%SZ")
-            embed.add_field(name="__In Theaters:__", value=f"{converted_date.strftime('%B %d, %Y')}", inline=True)
-            row_count += 1
-        if selected_movie_info.get("physicalRelease"):
-            converted_date = datetime.datetime.strptime(selected_movie_info["physicalRelease"], "%Y-%m-%dT%H:%M:%SZ")
-            embed.add_field(name="__Physical Release:__", value=f"{converted_date.strftime('%B %d, %Y')}", inline=True)
-            row_count += 1
-        if selected_movie_info.get("digitalRelease"):
-            converted_date = datetime.datetime.strptime(selected_movie_info["digitalRelease"], "%Y-%m-%dT%H:%M:%SZ")
-            embed.add_field(name="__Digital Release:__", value=f"{converted_date.strftime('%B %d, %Y')}", inline=True)
-            row_count += 1
-        
-        for _ in range(3 - row_count):
-            # fills the end of the row with empty fields
-            embed.add_field(name="\u200b", value="\u200b", inline=True)
-
-        # add ratings
-        row_count = 0
-        if selected_movie_info.get("ratings"):
-            if selected_movie_info["ratings"].get("rottenTomatoes"):
-                embed.add_field(name="<:rottentomatoes:1198430940054159491>", value=f"{selected_movie_info['ratings']['rottenTomatoes']['value']}%", inline=True)
-                row_count += 1
-            if selected_movie_info["ratings"].get("imdb"):
-                embed.add_field(name="<:imdb:1198433037172617346>", value=f"{selected_movie_info['ratings']['imdb']['value']:.2f}/10", inline=True)
-                row_count += 1
-            if selected_movie_info["ratings"].get("tmdb"):
-                embed.add_field(name="<:tmdb:1198437511970684978>", value=f"{selected_movie_info['ratings']['tmdb']['value']:.2f}/10", inline=True)
-                row_count += 1
-
-        if row_count != 0:
-            for _ in range(3 - row_count):
-                embed.add_field(name="\u200b", value="\u200b", inline=True)
-
-
-        if selected_movie_info.get("remotePoster"):
-            embed.set_image(url=selected_movie_info["remotePoster"])
-        
         # remove old buttons
         for item in list(self.view.children):
             if isinstance(item, discord.ui.Button):
                 self.view.remove_item(item)
 
-        if check_movie_downloaded(selected_movie_info):
+        try:
+            downloaded = await check_movie_downloaded(selected_movie_info, self.radarr)
+        except UNAVAILABLE_ERRORS:
+            await interaction.response.edit_message(content=unavailable_message(self.radarr), embed=embed, view=self.view)
+            return
+
+        if downloaded:
             # this means it is already downloaded.
             button = discord.ui.Button(label='Available', style=discord.ButtonStyle.primary)
             button.disabled = True
             self.view.add_item(button)
             await interaction.response.edit_message(content=f"**{selected_movie_info['title']}** has already been downloaded. Enjoy!", embed=embed, view=self.view)
-        elif selected_movie_info["monitored"]:
+            return
+
+        apply_library_status(selected_movie_info, self.radarr)
+        if selected_movie_info["monitored"]:
             # check if the user is already in the notification agent list
-            agent = next((agent for agent in notification_agents if agent.info["tmdbId"] == selected_movie_info["tmdbId"]), None)
+            agent = await notification_agents.get(self.radarr.name, selected_movie_info["tmdbId"])
             if agent:
-                if interaction.user not in agent.notified_members[interaction.channel_id]:
-                    agent.add_member(interaction.user, interaction.channel_id)
+                await notification_agents.add_member(agent, interaction.user, interaction.channel_id, interaction.message.id)
 
                 await interaction.response.edit_message(content=f"**{selected_movie_info['title']}** is already requested. You will be notified when it is available.", embed=embed, view=self.view)
             else:
                 # this means it was already requests but the bot likely lost connection and the notification agent was removed.
-                agent = NotificationAgent(instance_type="Radarr")
-                agent.info = selected_movie_info
-                agent.add_member(interaction.user, interaction.channel_id)
-                agent.embed = embed
-                notification_agents.append(agent)
+                await create_notification_agent(selected_movie_info, embed, interaction, self.radarr)
 
                 button = discord.ui.Button(label='Requested', style=discord.ButtonStyle.primary)
                 button.disabled = True
@@ -156,11 +290,11 @@ class SelectMenu(discord.ui.Select):
                 await interaction.response.edit_message(content=f"**{selected_movie_info['title']}** was already requested. Please wait for it to be available", embed=embed, view=self.view)
         else:
             # this means it is not requested or downloaded.
-            button = RequestButton(selected_movie_info, self.quality_profile, self.root_folder_path, embed)
+            button = RequestButton(selected_movie_info, self.radarr, self.quality_profile, self.root_folder_path, embed)
             self.view.add_item(button)
             await interaction.response.edit_message(content=f"**{selected_movie_info['title']}** is not downloaded or requested. Would you like to request it?", embed=embed, view=self.view)
             
 class MovieSelectView(discord.ui.View):
-    def __init__(self, *, timeout = 180, movies_found, quality_profile, root_folder_path):
+    def __init__(self, *, timeout = 180, movies_found, radarr_instance, quality_profile, root_folder_path):
         super().__init__(timeout=timeout)
-        self.add_item(SelectMenu(movies_found, quality_profile, root_folder_path))
\ No newline at end of file
+        self.add_item(SelectMenu(movies_found, radarr_instance, quality_profile, root_folder_path))
\ No newline at end of file
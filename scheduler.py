@@ -0,0 +1,89 @@
+import asyncio
+import heapq
+import time
+from typing import Hashable, Optional
+
+
+class PollScheduler:
+    """Min-heap of agent keys ordered by when each agent is next due to be checked.
+
+    Every key has its own interval: it is reset to `min_interval` when something is happening
+    (a fresh request or an active download) and doubles up to a cap while nothing changes.
+    """
+
+    def __init__(self, min_interval: float = 5):
+        self.min_interval = min_interval
+        self.heap: list[tuple[float, Hashable]] = []
+        self.due_at: dict[Hashable, float] = {}
+        self.intervals: dict[Hashable, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.due_at)
+
+    def _push(self, key: Hashable, interval: float):
+        due = time.monotonic() + interval
+        self.intervals[key] = interval
+        self.due_at[key] = due
+        # older heap entries for this key are skipped lazily in pop_due
+        heapq.heappush(self.heap, (due, key))
+
+    def add(self, key: Hashable):
+        """Schedules a new key to be checked right away"""
+        self.intervals[key] = self.min_interval
+        self.due_at[key] = time.monotonic()
+        heapq.heappush(self.heap, (self.due_at[key], key))
+
+    def reset(self, key: Hashable):
+        self._push(key, self.min_interval)
+
+    def backoff(self, key: Hashable, max_interval: float):
+        self._push(key, min(self.intervals.get(key, self.min_interval) * 2, max(max_interval, self.min_interval)))
+
+    def discard(self, key: Hashable):
+        self.due_at.pop(key, None)
+        self.intervals.pop(key, None)
+
+    def pop_due(self) -> list[Hashable]:
+        now = time.monotonic()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            when, key = heapq.heappop(self.heap)
+            if self.due_at.get(key) == when:
+                del self.due_at[key]
+                due.append(key)
+
+        return due
+
+    def next_due(self) -> Optional[float]:
+        """Seconds until the next key is due, or None if nothing is scheduled"""
+        while self.heap and self.due_at.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.monotonic(), 0)
+
+
+class RateLimiter:
+    """Token bucket that spaces calls out to at most `rate` per second"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated = time.monotonic()
+
+            self.tokens -= 1
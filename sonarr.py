@@ -1,48 +1,205 @@
-import discord
+import asyncio
+import copy
 import datetime
-from pyarr import SonarrAPI
+import logging
+from typing import Optional
+
+import discord
 
-from notifications import NotificationAgent, notification_agents
+import metrics
+from arr import UNAVAILABLE_ERRORS, ArrClient, missing_profile_message, unavailable_message
+from cache import normalize_term
+from notifications import NotificationAgent, notification_agents, pack_embed
+from progress import DownloadProgress, queue_progress
 
-sonarr = None
+QUEUE_PAGE_SIZE = 1000
 
-def get_series(title: str, sonarr_instance: SonarrAPI):
-    global sonarr
-    sonarr = sonarr_instance
-    series = sonarr.lookup_series(term=title)
-    return series[:25]
+async def get_series(title: str, sonarr_instance: ArrClient):
+    async def lookup():
+        series = await sonarr_instance.lookup_series(term=title)
+        sonarr_instance.title_index.update(series, "tvdbId")
+        return series[:25]
 
-def series_already_monitored(tvdbid: int):
-    series = sonarr.get_series(id_=tvdbid, tvdb=True)
+    series = await sonarr_instance.lookup_cache.get(normalize_term(title), lookup)
+    # requesting mutates the lookup dicts, so every caller gets its own copy
+    return copy.deepcopy(series)
+
+async def series_already_monitored(tvdbid: int, sonarr_instance: ArrClient):
+    # answer from the library index once it has been loaded, it is kept current in the background
+    if sonarr_instance.library.loaded:
+        return tvdbid in sonarr_instance.library
+
+    series = await sonarr_instance.get_series(id_=tvdbid, tvdb=True)
     if series:
+        sonarr_instance.library.update(series[0])
         return True
-    
+
     return False
 
-def create_notification_agent(series: dict, season: int, embed: discord.Embed, interaction: discord.Interaction):
-    existing_agent = next((agent for agent in notification_agents if agent.info["tvdbId"] == series["tvdbId"] and agent.season == season), None)
-    if not existing_agent:
-        agent = NotificationAgent(instance_type="Sonarr")
-        agent.info = series
-        agent.embed = embed
-        agent.season = season
-        agent.add_member(interaction.user, interaction.channel_id)
-        notification_agents.append(agent)
+def apply_library_status(series: dict, sonarr_instance: ArrClient):
+    """Sets which seasons are monitored from the library index, a cached lookup result can predate a request.
+    series_already_monitored has to run first, it puts the series in the index if the index isn't loaded yet"""
+    status = sonarr_instance.library.get(series["tvdbId"])
+    series["monitored"] = bool(status and status.monitored)
+    if status and status.id:
+        series["id"] = status.id
     else:
-        existing_agent.add_member(interaction.user, interaction.channel_id)
+        series.pop("id", None)
+    for season in series["seasons"]:
+        season["monitored"] = bool(status and status.seasons.get(season["seasonNumber"], (False, 0))[0])
+
+async def monitor_seasons(sonarr_instance: ArrClient, tvdb_id: int, seasons: set[int]) -> Optional[dict]:
+    """Monitors and searches for seasons of a series that is already in Sonarr, returns None if it isn't in Sonarr.
+    The seasons are set on Sonarr's current copy, a lookup result can be out of date"""
+    existing = await sonarr_instance.get_series(id_=tvdb_id, tvdb=True)
+    if not existing:
+        return None
+
+    series = existing[0]
+    series["monitored"] = True
+    for season in series["seasons"]:
+        season["monitored"] = season["monitored"] or season["seasonNumber"] in seasons
+    updated_series = await sonarr_instance.upd_series(series)
+    # Sonarr doesn't search for seasons that become monitored on its own
+    await sonarr_instance.post_command("SeriesSearch", seriesId=updated_series["id"])
+    return updated_series
+
+async def create_notification_agents(series: dict, seasons: list[int], embed: discord.Embed, interaction: discord.Interaction, sonarr_instance: ArrClient):
+    """Tracks every season with a single registry insert, adding the user to the seasons that are already tracked"""
+    # the message the request was made from is kept updated with the download progress
+    message_id = interaction.message.id if interaction.message else None
+    packed_embed = pack_embed(embed)
+    new_agents = []
+    for season in seasons:
+        existing_agent = await notification_agents.get(sonarr_instance.name, series["tvdbId"], season)
+        if existing_agent:
+            await notification_agents.add_member(existing_agent, interaction.user, interaction.channel_id, message_id)
+            continue
+
+        agent = NotificationAgent(instance_type="Sonarr", media_id=series["tvdbId"], title=series["title"], season=season, instance=sonarr_instance.name, embed=packed_embed)
+        agent.add_member(interaction.user, interaction.channel_id)
+        if message_id:
+            agent.add_message(message_id, interaction.channel_id)
+        new_agents.append(agent)
+
+    await notification_agents.add_many(new_agents)
+
+async def get_series_index(sonarr_instance: ArrClient) -> dict[int, dict]:
+    """Fetches the whole Sonarr library in a single call and indexes it by tvdbId"""
+    return {series["tvdbId"]: series for series in await sonarr_instance.get_series()}
+
+def season_downloaded(series: dict, tracked_season: int) -> bool:
+    if not series:
+        return False
 
-def check_series_season_downloaded(series_info: dict, tracked_season: int) -> bool:
-    series = sonarr.get_series(id_=series_info["tvdbId"], tvdb=True)
-    if len(series) > 0:
-        selected_season = next((season for season in series[0]["seasons"] if season["seasonNumber"] == tracked_season), None)
-        if selected_season and selected_season.get("statistics") and selected_season["statistics"]["percentOfEpisodes"] == 100:
-            return True
+    selected_season = next((season for season in series["seasons"] if season["seasonNumber"] == tracked_season), None)
+    if selected_season and selected_season.get("statistics") and selected_season["statistics"]["percentOfEpisodes"] == 100:
+        return True
 
     return False
 
+def season_released(series: dict, tracked_season: int) -> bool:
+    if not series:
+        return True
+
+    selected_season = next((season for season in series["seasons"] if season["seasonNumber"] == tracked_season), None)
+    # episodeCount only counts episodes that have already aired
+    return not (selected_season and selected_season.get("statistics") and selected_season["statistics"]["episodeCount"] == 0)
+
+async def get_queued_seasons(sonarr_instance: ArrClient, series_index: dict[int, dict]) -> dict[tuple[int, int], DownloadProgress]:
+    """Returns the download progress of every season in the queue, keyed by (tvdbId, season)"""
+    queue = await sonarr_instance.get_queue(page_size=QUEUE_PAGE_SIZE, include_episode=True)
+    tvdb_ids = {series["id"]: tvdb_id for tvdb_id, series in series_index.items()}
+
+    def season_key(record: dict) -> Optional[tuple[int, int]]:
+        season = record.get("seasonNumber", record.get("episode", {}).get("seasonNumber"))
+        if record.get("seriesId") in tvdb_ids and season is not None:
+            return (tvdb_ids[record["seriesId"]], season)
+        return None
+
+    return queue_progress(queue["records"], (season_key(record) for record in queue["records"]))
+
+async def bulk_request_series(series_list: list[dict], sonarr_instance: ArrClient, quality_profile_id: int, root_folder_path: str, interaction: discord.Interaction, concurrency: int) -> dict[str, list[str]]:
+    """Adds every series that isn't in Sonarr yet with all seasons monitored and tracks each season"""
+    summary = {"Requested": [], "Already requested": [], "Already available": [], "Failed": []}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(series: dict):
+        if await series_already_monitored(series["tvdbId"], sonarr_instance):
+            status = sonarr_instance.library.get(series["tvdbId"])
+            if not any(monitored for monitored, _ in status.seasons.values()):
+                # in Sonarr, but nothing is looking for it
+                updated_series = await monitor_seasons(sonarr_instance, series["tvdbId"], {number for number in status.seasons if number != 0})
+                if updated_series:
+                    sonarr_instance.record_change(updated_series)
+                    status = sonarr_instance.library.get(series["tvdbId"])
+                    pending_seasons = [number for number, (monitored, percent) in status.seasons.items() if monitored and number != 0 and percent < 100]
+                    await create_notification_agents(series, pending_seasons, build_series_embed(series), interaction, sonarr_instance)
+                    summary["Requested"].append(series["title"])
+                    return
+
+            # the user is subscribed to the monitored seasons that aren't downloaded yet
+            pending_seasons = [number for number, (monitored, percent) in status.seasons.items() if monitored and number != 0 and percent < 100]
+            if pending_seasons:
+                await create_notification_agents(series, pending_seasons, build_series_embed(series), interaction, sonarr_instance)
+            downloaded = not pending_seasons and any(monitored for monitored, _ in status.seasons.values())
+            summary["Already available" if downloaded else "Already requested"].append(series["title"])
+            return
+
+        for season in series["seasons"]:
+            season["monitored"] = season["seasonNumber"] != 0
+
+        # Sonarr has no batch add, so the adds run concurrently instead
+        async with semaphore:
+            try:
+                added_series = await sonarr_instance.add_series(series, quality_profile_id, 1, root_folder_path, ignore_episodes_with_files=True, search_for_missing_episodes=True)
+            except Exception:
+                logging.exception(f"Failed to add {series['title']}")
+                summary["Failed"].append(series["title"])
+                return
+
+        sonarr_instance.record_change(added_series)
+        monitored_seasons = [season["seasonNumber"] for season in series["seasons"] if season["monitored"]]
+        await create_notification_agents(series, monitored_seasons, build_series_embed(series), interaction, sonarr_instance)
+        summary["Requested"].append(series["title"])
+
+    await asyncio.gather(*(request(series) for series in series_list))
+    return summary
+
+def build_series_embed(series: dict) -> discord.Embed:
+    description = ""
+    if series.get("overview"):
+        if len(series["overview"]) > 255:
+            description = series["overview"][:255] + "(...)"
+        else:
+            description = series["overview"]
+
+    embed = discord.Embed(
+        title=f"{series['title']}",
+        url=f"https://www.theseriesdb.org/series/{series['tvdbId']}",
+        description=description,
+        color=0x3498db
+    )
+    embed.set_thumbnail(url="https://thetvdb.com/images/logo.png")
+    embed.set_footer(text=f"Powered by Seekarr")
+
+    # add firstAired and lastAired to embed
+    if series.get("firstAired"):
+        converted_date = datetime.datetime.strptime(series["firstAired"], "%Y-%m-%dT%H:%M:%SZ")
+        embed.add_field(name="__Airs:__", value=converted_date.strftime("%B %d, %Y"), inline=True)
+    if series.get("lastAired"):
+        converted_date = datetime.datetime.strptime(series["lastAired"], "%Y-%m-%dT%H:%M:%SZ")
+        embed.add_field(name="__Ends:__", value=converted_date.strftime("%B %d, %Y"), inline=True)
+
+    if series.get("remotePoster"):
+        embed.set_image(url=series["remotePoster"])
+
+    return embed
+
 class RequestSeasonsButton(discord.ui.Button):
-    def __init__(self, series, already_monitored, seasons, pretty_seasons,quality_profile, root_folder_path, embed):
+    def __init__(self, series, sonarr_instance, already_monitored, seasons, pretty_seasons, quality_profile, root_folder_path, embed):
         self.series = series
+        self.sonarr = sonarr_instance
         self.seasons = seasons
         self.pretty_seasons = pretty_seasons
         self.already_monitored = already_monitored
@@ -51,36 +208,35 @@ class RequestSeasonsButton(discord.ui.Button):
         self.embed = embed
         super().__init__(label='Request', style=discord.ButtonStyle.primary)
 
+    @metrics.timed_callback("sonarr_request")
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer()
 
-        quality_profiles = sonarr.get_quality_profile()
-        quality_profile_id = next(profile["id"] for profile in quality_profiles if profile["name"] == self.quality_profile)
-
+        # quality profiles are resolved at startup and refreshed in the background, a refresh can drop one
+        quality_profile_id = self.sonarr.quality_profiles.get(self.quality_profile)
+        if quality_profile_id is None:
+            await interaction.message.edit(content=missing_profile_message(self.sonarr, self.quality_profile), view=self.view)
+            return
 
-        if not self.already_monitored:
-            for season in self.series["seasons"]:
-                season["monitored"] = False
-
-        if "all" not in self.seasons:
-            for season in self.seasons:
-                season_info = next(season_info for season_info in self.series["seasons"] if season_info["seasonNumber"] == int(season))
-                season_info["monitored"] = True
-        else:
-            for season in self.series["seasons"]:
-                if season["seasonNumber"] != 0:
-                    season["monitored"] = True
-
-        if self.already_monitored:
-            sonarr.upd_series(self.series)
+        if "all" in self.seasons:
+            requested = {season["seasonNumber"] for season in self.series["seasons"] if season["seasonNumber"] != 0}
         else:
-            sonarr.add_series(self.series, quality_profile_id, 1, self.root_folder_path, ignore_episodes_with_files=True, search_for_missing_episodes=True)
-
-        # create notification agents for seasons that aren't already downloaded
-        for season in self.series["seasons"]:
-            if season["monitored"]:
-                if not check_series_season_downloaded(self.series, season["seasonNumber"]):
-                    create_notification_agent(self.series, season["seasonNumber"], self.embed, interaction)
+            requested = {int(season) for season in self.seasons}
+
+        try:
+            updated_series = await monitor_seasons(self.sonarr, self.series["tvdbId"], requested) if self.already_monitored else None
+            if not updated_series:
+                for season in self.series["seasons"]:
+                    season["monitored"] = season["seasonNumber"] in requested
+                updated_series = await self.sonarr.add_series(self.series, quality_profile_id, 1, self.root_folder_path, ignore_episodes_with_files=True, search_for_missing_episodes=True)
+        except UNAVAILABLE_ERRORS:
+            await interaction.message.edit(content=unavailable_message(self.sonarr), view=self.view)
+            return
+        self.sonarr.record_change(updated_series)
+
+        # the add/update response already has every season's statistics, so no season needs its own fetch
+        pending_seasons = [season["seasonNumber"] for season in updated_series["seasons"] if season["monitored"] and not season_downloaded(updated_series, season["seasonNumber"])]
+        await create_notification_agents(self.series, pending_seasons, self.embed, interaction, self.sonarr)
 
         self.label = "Requested"
         self.disabled = True
@@ -88,8 +244,9 @@ class RequestSeasonsButton(discord.ui.Button):
         await interaction.message.edit(content=f"Successfully requested {self.pretty_seasons} from **{self.series['title']}**!", view=self.view)
 
 class SeasonSelect(discord.ui.Select):
-    def __init__(self, series, already_monitored, quality_profile, root_folder_path, embed):
+    def __init__(self, series, sonarr_instance, already_monitored, quality_profile, root_folder_path, embed):
         self.series = series
+        self.sonarr = sonarr_instance
         self.quality_profile = quality_profile
         self.root_folder_path = root_folder_path
         self.already_monitored = already_monitored
@@ -109,6 +266,7 @@ class SeasonSelect(discord.ui.Select):
 
         super().__init__(placeholder="Select a season", min_values=1, max_values=season_count, options=seasons)
 
+    @metrics.timed_callback("sonarr_season_select")
     async def callback(self, interaction: discord.Interaction):
         selected_seasons = sorted(self.values)
         self.placeholder = "All Seasons" if "all" in selected_seasons else ", ".join(f"Season {season}" for season in selected_seasons)
@@ -123,7 +281,7 @@ class SeasonSelect(discord.ui.Select):
         else:
             pretty_seasons = "all seasons"
 
-        button = RequestSeasonsButton(self.series, self.already_monitored, selected_seasons, pretty_seasons, self.quality_profile, self.root_folder_path, self.embed)
+        button = RequestSeasonsButton(self.series, self.sonarr, self.already_monitored, selected_seasons, pretty_seasons, self.quality_profile, self.root_folder_path, self.embed)
         for item in list(self.view.children):
             if isinstance(item, discord.ui.Button):
                 self.view.remove_item(item)
@@ -134,8 +292,9 @@ class SeasonSelect(discord.ui.Select):
         await interaction.response.edit_message(content=f"Would you like to request {pretty_seasons} from **{self.series['title']}**?", view=self.view)
 
 class SelectMenu(discord.ui.Select):
-    def __init__(self, series, quality_profile, root_folder_path):
+    def __init__(self, series, sonarr_instance, quality_profile, root_folder_path):
         self.series = series
+        self.sonarr = sonarr_instance
         self.quality_profile = quality_profile
         self.root_folder_path = root_folder_path
         options = []
@@ -144,37 +303,13 @@ class SelectMenu(discord.ui.Select):
 
         super().__init__(placeholder="Select a series", min_values=1, max_values=1, options=options)
 
+    @metrics.timed_callback("sonarr_select")
     async def callback(self, interaction: discord.Interaction):
         selected_series = int(self.values[0])
         selected_series_info = self.series[selected_series]
         self.placeholder = selected_series_info["title"]
 
-        description = ""
-        if selected_series_info.get("overview"):
-            if len(selected_series_info["overview"]) > 255:
-                description = selected_series_info["overview"][:255] + "(...)"
-            else:
-                description = selected_series_info["overview"]
-
-        embed = discord.Embed(
-            title=f"{selected_series_info['title']}",
-            url=f"https://www.theseriesdb.org/series/{selected_series_info['tvdbId']}",
-            description=description,
-            color=0x3498db
-        )
-        embed.set_thumbnail(url="https://thetvdb.com/images/logo.png")
-        embed.set_footer(text=f"Powered by Seekarr")
-
-        # add firstAired and lastAired to embed
-        if selected_series_info.get("firstAired"):
-            converted_date = datetime.datetime.strptime(selected_series_info["firstAired"], "%Y-%m-%dT%H:%M:%SZ")
-            embed.add_field(name="__Airs:__", value=converted_date.strftime("%B %d, %Y"), inline=True)
-        if selected_series_info.get("lastAired"):
-            converted_date = datetime.datetime.strptime(selected_series_info["lastAired"], "%Y-%m-%dT%H:%M:%SZ")
-            embed.add_field(name="__Ends:__", value=converted_date.strftime("%B %d, %Y"), inline=True)
-
-        if selected_series_info.get("remotePoster"):
-            embed.set_image(url=selected_series_info["remotePoster"])
+        embed = build_series_embed(selected_series_info)
 
         for item in list(self.view.children):
             if isinstance(item, discord.ui.Button):
@@ -184,12 +319,18 @@ class SelectMenu(discord.ui.Select):
 
         selected_series_info["seasons"] = [season for season in selected_series_info["seasons"] if season["seasonNumber"] != 0]
 
-        self.view.add_item(SeasonSelect(selected_series_info, series_already_monitored(selected_series_info["tvdbId"]), self.quality_profile, self.root_folder_path, embed))
+        try:
+            already_monitored = await series_already_monitored(selected_series_info["tvdbId"], self.sonarr)
+        except UNAVAILABLE_ERRORS:
+            await interaction.response.edit_message(content=unavailable_message(self.sonarr), embed=embed, view=self.view)
+            return
+        apply_library_status(selected_series_info, self.sonarr)
+        self.view.add_item(SeasonSelect(selected_series_info, self.sonarr, already_monitored, self.quality_profile, self.root_folder_path, embed))
 
         await interaction.response.edit_message(content=f"**{selected_series_info['title']}** is not downloaded or requested. Would you like to request it?", embed=embed, view=self.view)
             
 
 class SeriesSelectView(discord.ui.View):
-    def __init__(self, *, timeout = 180, series_found, quality_profile, root_folder_path):
+    def __init__(self, *, timeout = 180, series_found, sonarr_instance, quality_profile, root_folder_path):
         super().__init__(timeout=timeout)
-        self.add_item(SelectMenu(series_found, quality_profile, root_folder_path))
\ No newline at end of file
+        self.add_item(SelectMenu(series_found, sonarr_instance, quality_profile, root_folder_path))
\ No newline at end of file
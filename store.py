@@ -0,0 +1,247 @@
+import asyncio
+import functools
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from notifications import NotificationAgent
+
+
+class AgentStore:
+    """Persists notification agents to SQLite so pending requests survive restarts.
+
+    Several processes (e.g. one per group of shards) can share the same database, see NotificationRegistry.shared.
+    Every change to an agent is recorded in a journal by triggers, so a process can read just what changed since
+    its last read. Methods never modify the agents passed to them, they run on the store's own thread through `run`.
+    """
+
+    # how long, in seconds, journal entries are kept
+    JOURNAL_RETENTION = 3600
+
+    def __init__(self, path: str):
+        # other processes sharing the database can hold the write lock for a while, which only ever blocks this thread
+        self.connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AgentStore")
+        # WAL keeps the small per-request writes cheap and never blocks readers
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS agents (
+                key TEXT PRIMARY KEY,
+                instance_type TEXT NOT NULL,
+                instance TEXT NOT NULL,
+                season INTEGER,
+                info TEXT NOT NULL,
+                embed TEXT,
+                -- set while a process announces the agent, the row is only deleted once the notifications were sent
+                claimed REAL
+            );
+            CREATE TABLE IF NOT EXISTS members (
+                agent_key TEXT NOT NULL REFERENCES agents(key) ON DELETE CASCADE,
+                channel_id INTEGER NOT NULL,
+                member_id INTEGER NOT NULL,
+                PRIMARY KEY (agent_key, channel_id, member_id)
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                agent_key TEXT NOT NULL REFERENCES agents(key) ON DELETE CASCADE,
+                message_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                PRIMARY KEY (agent_key, message_id)
+            );
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                agent_key TEXT NOT NULL,
+                created REAL NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS REAL))
+            );
+            CREATE INDEX IF NOT EXISTS journal_created ON journal (created);
+            CREATE TRIGGER IF NOT EXISTS journal_agent_insert AFTER INSERT ON agents BEGIN INSERT INTO journal (agent_key) VALUES (NEW.key); END;
+            CREATE TRIGGER IF NOT EXISTS journal_agent_update AFTER UPDATE ON agents BEGIN INSERT INTO journal (agent_key) VALUES (NEW.key); END;
+            CREATE TRIGGER IF NOT EXISTS journal_agent_delete AFTER DELETE ON agents BEGIN INSERT INTO journal (agent_key) VALUES (OLD.key); END;
+            CREATE TRIGGER IF NOT EXISTS journal_member_insert AFTER INSERT ON members BEGIN INSERT INTO journal (agent_key) VALUES (NEW.agent_key); END;
+            CREATE TRIGGER IF NOT EXISTS journal_member_delete AFTER DELETE ON members BEGIN INSERT INTO journal (agent_key) VALUES (OLD.agent_key); END;
+            CREATE TRIGGER IF NOT EXISTS journal_message_insert AFTER INSERT ON messages BEGIN INSERT INTO journal (agent_key) VALUES (NEW.agent_key); END;
+        """)
+        self.connection.execute("PRAGMA foreign_keys=ON")
+
+    async def run(self, method: Callable[..., Any], *args) -> Any:
+        """Runs a store method on the store's thread, so waiting on the database never blocks the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(method, *args))
+
+    @staticmethod
+    def row_key(agent: NotificationAgent) -> str:
+        return ":".join(str(part) for part in agent.key)
+
+    @staticmethod
+    def parse_key(key: str) -> tuple[str, int, Optional[int]]:
+        instance, media_id, season = key.rsplit(":", 2)
+        return (instance, int(media_id), None if season == "None" else int(season))
+
+    @staticmethod
+    def compact_info(agent: NotificationAgent) -> dict:
+        return {"tmdbId" if agent.instance_type == "Radarr" else "tvdbId": agent.media_id, "title": agent.title}
+
+    @classmethod
+    def agent_rows(cls, agents: list[NotificationAgent]) -> tuple[list[tuple], list[tuple], list[tuple]]:
+        """The agent, member and message rows of the agents, built on the caller's thread while nothing changes them"""
+        return (
+            [(cls.row_key(agent), agent.instance_type, agent.instance, agent.season, json.dumps(cls.compact_info(agent)), agent.embed) for agent in agents],
+            [(cls.row_key(agent), channel_id, member_id) for agent in agents for channel_id, members in agent.notified_members.items() for member_id in members],
+            [(cls.row_key(agent), message_id, channel_id) for agent in agents for message_id, channel_id in agent.messages.items()],
+        )
+
+    def save_many(self, rows: tuple[list[tuple], list[tuple], list[tuple]]):
+        """Saves the rows from agent_rows in a single transaction"""
+        agent_rows, member_rows, message_rows = rows
+        with self.connection:
+            # never replace, that would drop the members another process added to the same request
+            self.connection.executemany("INSERT OR IGNORE INTO agents (key, instance_type, instance, season, info, embed) VALUES (?, ?, ?, ?, ?, ?)", agent_rows)
+            self.connection.executemany("INSERT OR IGNORE INTO members (agent_key, channel_id, member_id) VALUES (?, ?, ?)", member_rows)
+            self.connection.executemany("INSERT OR IGNORE INTO messages (agent_key, message_id, channel_id) VALUES (?, ?, ?)", message_rows)
+
+    def add_member(self, agent: NotificationAgent, member_id: int, channel_id: int):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO members (agent_key, channel_id, member_id) VALUES (?, ?, ?)",
+                (self.row_key(agent), channel_id, member_id),
+            )
+
+    def add_message(self, agent: NotificationAgent, message_id: int, channel_id: int):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO messages (agent_key, message_id, channel_id) VALUES (?, ?, ?)",
+                (self.row_key(agent), message_id, channel_id),
+            )
+
+    def claim(self, agent_key: tuple, ttl: float) -> Optional[NotificationAgent]:
+        """Marks the agent as being announced and returns it with every stored member, including the ones added by
+        other processes. Returns None if it is gone or another process claimed it less than `ttl` seconds ago,
+        a claim that old belongs to a process that stopped before it finished."""
+        now = time.time()
+        with self.connection:
+            cursor = self.connection.execute(
+                "UPDATE agents SET claimed = ? WHERE key = ? AND (claimed IS NULL OR claimed < ?)",
+                (now, ":".join(str(part) for part in agent_key), now - ttl),
+            )
+            return self.get(agent_key) if cursor.rowcount > 0 else None
+
+    def delivered(self, agent: NotificationAgent, channel_id: int, member_ids: set[int]):
+        """Deletes the members that were notified in a channel"""
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM members WHERE agent_key = ? AND channel_id = ? AND member_id = ?",
+                [(self.row_key(agent), channel_id, member_id) for member_id in member_ids],
+            )
+
+    def release(self, agent: NotificationAgent) -> bool:
+        """Deletes a claimed agent once no member is left to notify, otherwise clears the claim so it is announced again.
+        Returns True if members are left."""
+        key = self.row_key(agent)
+        with self.connection:
+            self.prune_journal()
+            cursor = self.connection.execute("DELETE FROM agents WHERE key = ? AND NOT EXISTS (SELECT 1 FROM members WHERE agent_key = ?)", (key, key))
+            if cursor.rowcount > 0:
+                return False
+            cursor = self.connection.execute("UPDATE agents SET claimed = NULL WHERE key = ?", (key,))
+        return cursor.rowcount > 0
+
+    def merge(self, agent: NotificationAgent):
+        """Adds the stored members and messages of the agent to it"""
+        key = self.row_key(agent)
+        for channel_id, member_id in self.connection.execute("SELECT channel_id, member_id FROM members WHERE agent_key = ?", (key,)):
+            agent.notified_members.setdefault(channel_id, set()).add(member_id)
+        for message_id, channel_id in self.connection.execute("SELECT message_id, channel_id FROM messages WHERE agent_key = ?", (key,)):
+            agent.messages.setdefault(message_id, channel_id)
+
+    @staticmethod
+    def build(instance_type: str, instance: str, season: Optional[int], info: str, embed: Optional[str]) -> NotificationAgent:
+        info = json.loads(info)
+        return NotificationAgent(
+            instance_type=instance_type,
+            media_id=info["tmdbId" if instance_type == "Radarr" else "tvdbId"],
+            title=info["title"],
+            season=season,
+            instance=instance,
+            embed=embed,
+        )
+
+    def get(self, agent_key: tuple) -> Optional[NotificationAgent]:
+        key = ":".join(str(part) for part in agent_key)
+        row = self.connection.execute("SELECT instance_type, instance, season, info, embed FROM agents WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+
+        agent = self.build(*row)
+        self.merge(agent)
+        return agent
+
+    def load(self) -> tuple[int, list[NotificationAgent]]:
+        """Returns every stored agent, and the journal position to read the changes made since from"""
+        # taken first, a change made while loading is read again on the next call to changes
+        position = self.position()
+        agents = {}
+        for key, instance_type, instance, season, info, embed in self.connection.execute("SELECT key, instance_type, instance, season, info, embed FROM agents"):
+            agents[key] = self.build(instance_type, instance, season, info, embed)
+
+        for agent_key, channel_id, member_id in self.connection.execute("SELECT agent_key, channel_id, member_id FROM members"):
+            if agent_key in agents:
+                agents[agent_key].notified_members.setdefault(channel_id, set()).add(member_id)
+
+        for agent_key, message_id, channel_id in self.connection.execute("SELECT agent_key, message_id, channel_id FROM messages"):
+            if agent_key in agents:
+                agents[agent_key].messages.setdefault(message_id, channel_id)
+
+        return position, list(agents.values())
+
+    def position(self) -> int:
+        row = self.connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+        return row[0] if row else 0
+
+    def changes(self, since: int) -> Optional[tuple[int, dict[tuple, Optional[NotificationAgent]]]]:
+        """Returns the new journal position and the current state of every agent changed after `since`, None for
+        the ones that were deleted. Returns None if those changes were already pruned from the journal."""
+        with self.connection:
+            self.prune_journal()
+        rows = self.connection.execute("SELECT id, agent_key FROM journal WHERE id > ? ORDER BY id", (since,)).fetchall()
+        # ids have no gaps, except for the entries pruned from the start of the journal
+        first = rows[0][0] if rows else self.position() + 1
+        if first > since + 1:
+            return None
+
+        keys = dict.fromkeys(key for _, key in rows)
+        return (rows[-1][0] if rows else since), {self.parse_key(key): self.get(self.parse_key(key)) for key in keys}
+
+    def prune_journal(self):
+        self.connection.execute("DELETE FROM journal WHERE created < ?", (time.time() - self.JOURNAL_RETENTION,))
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Takes or renews the named lease, returns True if `holder` holds it for the next `ttl` seconds"""
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                """INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires
+                WHERE leases.holder = excluded.holder OR leases.expires < ?""",
+                (name, holder, now + ttl, now),
+            )
+            (current_holder,) = self.connection.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+        return current_holder == holder
+
+    def get_setting(self, key: str) -> Optional[str]:
+        row = self.connection.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_setting(self, key: str, value: str):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
@@ -0,0 +1,35 @@
+import logging
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+
+async def start_webhook_server(on_event: Callable[[dict, Optional[str]], Awaitable[None]], host: str, port: int, token: Optional[str] = None) -> web.AppRunner:
+    """Serves POST /webhook for Radarr and Sonarr "On Import" notifications"""
+
+    async def receive(request: web.Request) -> web.Response:
+        if token and request.query.get("token") != token:
+            return web.Response(status=401)
+
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Expected a JSON body")
+
+        logging.info(f"Received {payload.get('eventType')} webhook")
+        try:
+            await on_event(payload, request.query.get("instance"))
+        except Exception:
+            logging.exception("Failed to handle webhook")
+            return web.Response(status=500)
+
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post("/webhook", receive)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Listening for webhooks on {host}:{port}")
+    return runner